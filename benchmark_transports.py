@@ -0,0 +1,325 @@
+"""
+    Benchmark of the two game -> gui transports in this project:
+    - queue: part1.py's TaskQueue drained by QueueHandler
+    - event: part1_alternative.py's EventHandler with Gui's waiter thread
+
+    Both run headlessly: the real Game classes produce the updates, the
+    real consumer code draws them on a stub canvas, and a "main loop"
+    thread stands in for Tk by running the callbacks that would go through
+    after_idle. The snake follows a cycle that covers the whole board, so
+    it never dies, and its length is fixed by keeping the prey off the
+    board.
+
+    For each transport, tick rate and snake length it reports throughput
+    (frames drawn and ticks delivered per second), producer to consumer
+    latency percentiles, ticks not latest in a frame (ticks whose state was
+    never the latest one in a drawn frame), queue drops and CPU time.
+
+    Only the event transport loses the ticks that were not latest in a
+    frame: its handler keeps the newest update, so they were overwritten
+    before being drawn. The queue transport still applies them, in a frame
+    that also draws later ticks; the ticks it loses are its drops.
+
+    Usage: python benchmark_transports.py [--rates 60,1000,10000]
+           [--lengths 5,100,600] [--duration 2] [--json results.json]
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Tuple
+
+import part1
+import part1_alternative
+
+
+class StubCanvas:
+    """Accepts the canvas calls the consumers make and counts them."""
+    def __init__(self) -> None:
+        self.calls = 0
+        self.nextItem = 0
+
+    def createItem(self, *args, **kwargs) -> int:
+        self.calls += 1
+        self.nextItem += 1
+        return self.nextItem
+
+    create_line = create_rectangle = create_text = create_window = createItem
+
+    def coords(self, *args) -> None:
+        self.calls += 1
+
+    def itemconfigure(self, *args, **kwargs) -> None:
+        self.calls += 1
+
+    def delete(self, *args) -> None:
+        self.calls += 1
+
+    def tag_lower(self, *args) -> None:
+        self.calls += 1
+
+
+class StubMainLoop:
+    """
+        Runs callbacks handed over with after_idle on its own thread, like
+        the Tk main loop would, and measures that thread's CPU time.
+    """
+    def __init__(self) -> None:
+        self.callbacks: "queue.SimpleQueue" = queue.SimpleQueue()
+        self.tk = object()  # no createfilehandler, so QueueHandler uses after_idle
+        self.cpuTime = 0.0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def after_idle(self, callback: Callable, *args) -> None:
+        self.callbacks.put((callback, args))
+
+    def run(self) -> None:
+        while True:
+            callback, args = self.callbacks.get()
+            if callback is None:
+                break
+            callback(*args)
+        self.cpuTime = time.thread_time()
+
+    def stop(self) -> None:
+        self.callbacks.put((None, ()))
+        self.thread.join()
+
+
+def boardCycle() -> List[Tuple[int, int]]:
+    """
+        Returns the centres of all snake cells in an order that visits each
+        once and ends next to where it started: down and up the columns
+        below the top row, then back along the top row.
+    """
+    columns = range(0, part1.WINDOW_WIDTH, part1.SNAKE_ICON_WIDTH)
+    rows = list(range(10, part1.WINDOW_HEIGHT, part1.SNAKE_ICON_WIDTH))
+    cycle = []
+    for i, x in enumerate(columns):
+        cycle.extend((x, y) for y in (rows[1:] if i % 2 == 0 else reversed(rows[1:])))
+    cycle.extend((x, rows[0]) for x in reversed(columns))
+    return cycle
+
+
+def steer(game, cycle: List[Tuple[int, int]], position: int) -> None:
+    """Points the snake at cycle[position], its next cell."""
+    (headX, headY), (nextX, nextY) = game.snakeCoordinates[-1], cycle[position]
+    if nextX < headX:
+        game.direction = "Left"
+    elif nextX > headX:
+        game.direction = "Right"
+    elif nextY < headY:
+        game.direction = "Up"
+    else:
+        game.direction = "Down"
+
+
+def placeSnake(game, cycle: List[Tuple[int, int]], length: int) -> None:
+    """Lays the snake on the first length cells of the cycle, prey off the board."""
+    game.snakeCoordinates = deque(cycle[:length])
+    game.occupiedCells = set(game.snakeCoordinates)
+    game.preyCoordinates = (0, 0, 0, 0)
+
+
+class TickLog:
+    """Production times by tick, and the ticks delivered to the consumer."""
+    def __init__(self) -> None:
+        self.produced: Dict[int, float] = {}
+        self.latencies: List[float] = []
+        self.delivered = 0
+        self.framesLatest: set = set()
+        self.frames = 0
+
+    def deliver(self, ticks: List[int], now: float) -> None:
+        for tick in ticks:
+            self.latencies.append(now - self.produced[tick])
+        self.delivered += len(ticks)
+        if ticks:
+            self.frames += 1
+            self.framesLatest.add(max(ticks))
+
+
+class BenchTaskQueue(part1.TaskQueue):
+    """TaskQueue that tags moves and keyframes with the tick that produced them."""
+    def __init__(self, log: TickLog) -> None:
+        super().__init__()
+        self.log = log
+        self.tick = 0
+
+    def put(self, task: dict) -> None:
+        if "move" in task or "keyframe" in task:
+            task["tick"] = self.tick
+        super().put(task)
+
+    def drain(self) -> deque:
+        tasks = super().drain()
+        self.log.deliver([task["tick"] for task in tasks if "tick" in task], time.perf_counter())
+        return tasks
+
+
+class QueueGui:
+    """The parts of part1.Gui that QueueHandler uses."""
+    createSegment = part1.Gui.createSegment
+
+    def __init__(self, mainLoop: StubMainLoop) -> None:
+        self.root = mainLoop
+        self.canvas = StubCanvas()
+        self.preyIcon = self.canvas.create_rectangle()
+        self.score = self.canvas.create_text()
+
+    def gameOver(self, message: str = "Game Over!") -> None:
+        pass
+
+
+class EventGui:
+    """The parts of part1_alternative.Gui that its event loop and drawing use."""
+    event_handler_loop = part1_alternative.Gui.event_handler_loop
+    apply_updates = part1_alternative.Gui.apply_updates
+
+    def __init__(self, mainLoop: StubMainLoop, eventHandler, log: TickLog, firstVersion: int) -> None:
+        self.root = mainLoop
+        self.event_handler = eventHandler
+        self.log = log
+        self.firstVersion = firstVersion
+        self.canvas = StubCanvas()
+        self.snakeIcon = self.canvas.create_line()
+        self.preyIcon = self.canvas.create_rectangle()
+        self.score = self.canvas.create_text()
+        self.seen = dict(eventHandler.versions)
+        self.frame_done = threading.Event()
+        self.frame_done.set()
+        self.main_loop_started = threading.Event()
+        self.main_loop_started.set()
+
+    def drawUpdates(self, updates: dict) -> None:
+        if "move" in updates:
+            # A move's version counts set_task calls, so it maps straight to
+            # a tick; the versions skipped since the last frame were lost
+            version = updates["move"][0]
+            self.log.deliver([version - self.firstVersion], time.perf_counter())
+        EventGui.apply_updates(self, updates)
+
+    def gameOver(self) -> None:
+        pass
+
+
+def runTransport(transport: str, rate: float, length: int, duration: float) -> dict:
+    cycle = boardCycle()
+    log = TickLog()
+    log.produced[0] = time.perf_counter()  # the starting state
+    mainLoop = StubMainLoop()
+
+    if transport == "queue":
+        taskQueue = BenchTaskQueue(log)
+        game = part1.Game(taskQueue)
+        placeSnake(game, cycle, length)
+        gui = QueueGui(mainLoop)
+        handler = part1.QueueHandler(gui, taskQueue)
+        taskQueue.put({"keyframe": tuple(game.snakeCoordinates)})
+        canvas = gui.canvas
+
+        def setTick(tick: int) -> None:
+            taskQueue.tick = tick
+    else:
+        eventHandler = part1_alternative.EventHandler()
+        game = part1_alternative.Game(eventHandler)
+        placeSnake(game, cycle, length)
+        gui = EventGui(mainLoop, eventHandler, log, eventHandler.versions["move"])
+        gui.apply_updates = gui.drawUpdates
+        threading.Thread(target=gui.event_handler_loop, daemon=True).start()
+        canvas = gui.canvas
+
+        def setTick(tick: int) -> None:
+            pass
+
+    mainLoop.thread.start()
+    scheduler = part1.TickScheduler(1.0 / rate)
+    position = length % len(cycle)
+    tick = 0
+    producerCpu = [0.0]
+    deadline = time.monotonic() + duration
+    startCpu = time.process_time()
+    start = time.perf_counter()
+
+    def produce() -> bool:
+        nonlocal position, tick
+        tick += 1
+        setTick(tick)
+        steer(game, cycle, position)
+        position = (position + 1) % len(cycle)
+        # Stamped before move() puts the update, so the consumer can never see it first
+        log.produced[tick] = time.perf_counter()
+        game.move()
+        if time.monotonic() >= deadline:
+            producerCpu[0] = time.thread_time()
+            return False
+        return True
+
+    producer = threading.Thread(target=scheduler.run, args=(produce,))
+    producer.start()
+    producer.join()
+    time.sleep(0.05)  # let the consumer draw what is still queued
+    elapsed = time.perf_counter() - start
+    mainLoop.stop()
+    cpu = time.process_time() - startCpu
+
+    latencies = sorted(log.latencies)
+
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1e6 if latencies else 0.0
+
+    return {
+        "transport": transport,
+        "rate": rate,
+        "length": length,
+        "ticks": tick,
+        "frames": log.frames,
+        "framesPerSecond": log.frames / elapsed,
+        "deliveredPerSecond": log.delivered / elapsed,
+        "latencyUs": {"p50": percentile(0.50), "p90": percentile(0.90),
+                      "p99": percentile(0.99), "max": percentile(1.0)},
+        "notLatestInFrame": sum(1 for t in range(1, tick + 1) if t not in log.framesLatest),
+        "dropped": game.queue.dropped if transport == "queue" else 0,
+        "canvasCalls": canvas.calls,
+        "cpuSeconds": cpu,
+        "producerCpuSeconds": producerCpu[0],
+        "consumerCpuSeconds": mainLoop.cpuTime,
+        "tickJitterP99Us": scheduler.jitterStats()["p99"] * 1e6,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the Queue and EventHandler transports.")
+    parser.add_argument("--rates", default="60,1000,10000", help="tick rates per second, comma separated")
+    parser.add_argument("--lengths", default="5,100,600", help="snake lengths, comma separated")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per run")
+    parser.add_argument("--transports", default="queue,event")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    maxLength = len(boardCycle()) - 1
+    results = []
+    print(f"{'transport':<9} {'rate':>6} {'len':>4} {'ticks':>7} {'frames/s':>9} {'p50 us':>8} "
+          f"{'p99 us':>8} {'!latest':>7} {'dropped':>7} {'cpu s':>6}")
+    for rate in (float(r) for r in args.rates.split(",")):
+        for length in (int(n) for n in args.lengths.split(",")):
+            if not 2 <= length <= maxLength:
+                print(f"skipping length {length}: must be between 2 and {maxLength}")
+                continue
+            for transport in args.transports.split(","):
+                result = runTransport(transport, rate, length, args.duration)
+                results.append(result)
+                print(f"{transport:<9} {rate:>6.0f} {length:>4} {result['ticks']:>7} "
+                      f"{result['framesPerSecond']:>9.1f} {result['latencyUs']['p50']:>8.0f} "
+                      f"{result['latencyUs']['p99']:>8.0f} {result['notLatestInFrame']:>7} "
+                      f"{result['dropped']:>7} {result['cpuSeconds']:>6.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
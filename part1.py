@@ -2,10 +2,11 @@
 # Student Names: Nikoo Vali , Sara Hematy , Julia Wadey
 
 import threading
-import queue
-from tkinter import Tk, Canvas, Button, Event
-import random, time
-from typing import Tuple, List
+import os
+from tkinter import Tk, Canvas, Button, Event, READABLE, TclError
+import random, time, sys, json
+from collections import deque
+from typing import Tuple, Deque, Set, List, Dict, Iterable, Optional, Callable
 
 # Global constants
 WINDOW_WIDTH = 500
@@ -14,9 +15,10 @@ SNAKE_ICON_WIDTH = 15
 PREY_ICON_WIDTH = 15  
 BACKGROUND_COLOUR = "green"
 ICON_COLOUR = "yellow"
+KEYFRAME_INTERVAL = 100  # ticks between full-body "keyframe" tasks
 
 class Gui:
-    def __init__(self) -> None:
+    def __init__(self, game: "Game") -> None:
         scoreTextXLocation = 60
         scoreTextYLocation = 15
         textColour = "white"
@@ -25,8 +27,7 @@ class Gui:
         self.canvas = Canvas(self.root, width=WINDOW_WIDTH, height=WINDOW_HEIGHT, bg=BACKGROUND_COLOUR)
         self.canvas.pack()
 
-        # Create snake and prey icons
-        self.snakeIcon = self.canvas.create_line((0,0), (0,0), fill=ICON_COLOUR, width=SNAKE_ICON_WIDTH)
+        # Create prey icon; the snake is drawn one segment item at a time (see createSegment)
         self.preyIcon = self.canvas.create_rectangle(0,0,0,0, fill=ICON_COLOUR, outline=ICON_COLOUR)
 
         # Initial score display
@@ -39,90 +40,534 @@ class Gui:
         for key in ("Left", "Right", "Up", "Down"):
             self.root.bind(f"<Key-{key}>", game.whenAnArrowKeyIsPressed)
 
+    def createSegment(self, start: Tuple[int,int], end: Tuple[int,int]) -> int:
+        """
+            Creates one snake segment as a line between two consecutive
+            body points, kept below the prey and score. Projecting caps
+            make neighbouring segments overlap so corners are filled.
+        """
+        segment = self.canvas.create_line(start, end, fill=ICON_COLOUR, width=SNAKE_ICON_WIDTH,
+                                          capstyle="projecting")
+        self.canvas.tag_lower(segment)
+        return segment
+
     #Game over button, by clicking it you exit the game
-    def gameOver(self) -> None:
-        gameOverButton = Button(self.canvas, text="Game Over!", 
+    def gameOver(self, message: str = "Game Over!") -> None:
+        gameOverButton = Button(self.canvas, text=message, 
                                 height=3, width=10, font=("Helvetica", "14", "bold"), 
                                 command=self.root.destroy)
         self.canvas.create_window(200, 100, anchor="nw", window=gameOverButton)
 
 
+class Histogram:
+    """
+        A histogram with power-of-two buckets, cheap enough to record into
+        on every frame. Values are multiplied by scale and rounded to an
+        integer before bucketing (seconds with scale 1e6 give microseconds).
+    """
+    def __init__(self, unit: str, scale: float = 1.0) -> None:
+        self.unit = unit
+        self.scale = scale
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value: float) -> None:
+        scaled = max(0, int(value * self.scale))
+        bucket = scaled.bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += scaled
+        self.max = max(self.max, scaled)
+
+    def percentile(self, p: float) -> int:
+        """Upper bound of the bucket holding the p-th fraction of values."""
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= p * self.count:
+                return min((1 << bucket) - 1, self.max)
+        return self.max
+
+    def toDict(self) -> dict:
+        return {
+            "unit": self.unit,
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0,
+            "max": self.max,
+            "p50": self.percentile(0.50),
+            "p90": self.percentile(0.90),
+            "p99": self.percentile(0.99),
+            # bucket upper bound -> number of values
+            "buckets": {(1 << bucket) - 1: n for bucket, n in sorted(self.buckets.items())},
+        }
+
+
+class PipelineMetrics:
+    """
+        Optional instrumentation of the game -> queue -> canvas pipeline.
+        With it attached, the TaskQueue stamps every task with its
+        production time, and the game thread and QueueHandler record:
+        - moveTime: how long Game.move took (game thread)
+        - queueWait: production to the start of drawing, per task (queue)
+        - render: time spent drawing one drained batch (Tk)
+        - queueDepth: number of tasks drained per batch
+        plus counts of frames, coalesced tasks and dropped moves.
+        dump() writes everything, with the tick jitter, as JSON.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.moveTime = Histogram("us", 1e6)
+        self.queueWait = Histogram("us", 1e6)
+        self.render = Histogram("us", 1e6)
+        self.queueDepth = Histogram("tasks")
+        self.frames = 0
+        self.coalesced = 0
+
+    def recordMove(self, seconds: float) -> None:
+        with self.lock:
+            self.moveTime.record(seconds)
+
+    def recordFrame(self, tasks: Deque[dict], started: float, finished: float, coalesced: int) -> None:
+        with self.lock:
+            self.frames += 1
+            self.coalesced += coalesced
+            self.queueDepth.record(len(tasks))
+            self.render.record(finished - started)
+            for task in tasks:
+                if "produced" in task:
+                    self.queueWait.record(started - task["produced"])
+
+    def dump(self, path: str, taskQueue: Optional["TaskQueue"] = None,
+             scheduler: Optional["TickScheduler"] = None) -> None:
+        with self.lock:
+            report = {
+                "frames": self.frames,
+                "coalesced": self.coalesced + (taskQueue.coalesced if taskQueue else 0),
+                "dropped": taskQueue.dropped if taskQueue else 0,
+                "moveTime": self.moveTime.toDict(),
+                "queueWait": self.queueWait.toDict(),
+                "render": self.render.toDict(),
+                "queueDepth": self.queueDepth.toDict(),
+                "tickJitter": scheduler.jitterStats() if scheduler else None,
+            }
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+class TaskQueue:
+    """
+        This class is the bounded, thread-safe queue that carries tasks
+        from the game thread to the GUI. Each item is a dictionary whose
+        key is the task type (for example, "move") and whose value is
+        the task value.
+        put() never blocks the game thread. Superseded tasks are dropped
+        instead: a keyframe replaces every queued move and keyframe, and
+        when the queue is full the oldest prey/score task that has a newer
+        one behind it goes first. If only moves are left to drop, all
+        queued moves are discarded, and the new one and later ones are
+        refused until the game sends a keyframe, and wantsKeyframe() asks it to send one now.
+        With no move queued either, the oldest prey/score task is dropped;
+        a keyframe and the end of the game are never dropped.
+        The consumer is woken through the wakeup callback once per batch.
+        With metrics attached, each task gets a "produced" timestamp.
+    """
+    def __init__(self, maxsize: int = 64, metrics: Optional[PipelineMetrics] = None) -> None:
+        self.maxsize = maxsize
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.tasks: Deque[dict] = deque()
+        self.wakeup: Optional[Callable[[], None]] = None
+        self.wakeupPending = False
+        self.awaitingKeyframe = False
+        self.coalesced = 0  # superseded tasks removed before they were drawn
+        self.dropped = 0    # tasks thrown away because the queue was full
+
+    def put(self, task: dict) -> None:
+        if self.metrics is not None:
+            task["produced"] = time.perf_counter()
+        with self.lock:
+            if "keyframe" in task:
+                kept = deque(queued for queued in self.tasks
+                             if "move" not in queued and "keyframe" not in queued)
+                self.coalesced += len(self.tasks) - len(kept)
+                self.tasks = kept
+                self.awaitingKeyframe = False
+            elif "move" in task and self.awaitingKeyframe:
+                self.dropped += 1
+                return
+            if len(self.tasks) >= self.maxsize:
+                self.dropOldest()
+                if "move" in task and self.awaitingKeyframe:
+                    # The moves it builds on are gone; only a keyframe can follow them
+                    self.dropped += 1
+                    return
+            self.tasks.append(task)
+            wake = not self.wakeupPending
+            self.wakeupPending = True
+        if wake and self.wakeup is not None:
+            self.wakeup()
+
+    def dropOldest(self) -> None:
+        """
+            Makes room for one task; called with the lock held.
+        """
+        latest: Dict[str, int] = {}
+        for i, queued in enumerate(self.tasks):
+            for kind in ("prey", "score"):
+                if kind in queued:
+                    latest[kind] = i
+        for i, queued in enumerate(self.tasks):
+            for kind in ("prey", "score"):
+                if kind in queued and latest[kind] != i:
+                    del self.tasks[i]
+                    self.coalesced += 1
+                    return
+        kept = deque(queued for queued in self.tasks if "move" not in queued)
+        if len(kept) < len(self.tasks):
+            self.dropped += len(self.tasks) - len(kept)
+            self.tasks = kept
+            self.awaitingKeyframe = True
+            return
+        for i, queued in enumerate(self.tasks):
+            if "prey" in queued or "score" in queued:
+                del self.tasks[i]
+                self.dropped += 1
+                return
+
+    def wantsKeyframe(self) -> bool:
+        return self.awaitingKeyframe
+
+    def drain(self) -> Deque[dict]:
+        """
+            Takes every queued task at once, oldest first.
+        """
+        with self.lock:
+            tasks = self.tasks
+            self.tasks = deque()
+            self.wakeupPending = False
+        return tasks
+
+
 class QueueHandler:
     """
         This class implements the queue handler for the game.
     """
-    def __init__(self) -> None:
-        self.queue = gameQueue
+    def __init__(self, gui: Gui, taskQueue: TaskQueue) -> None:
+        self.queue = taskQueue
         self.gui = gui
+        # Canvas items of the snake's segments, tail first, and the head
+        # point they end at; rebuilt by keyframes and updated by move deltas
+        self.segments: Deque[int] = deque()
+        self.snakeHead: Optional[Tuple[int,int]] = None
+        # The wakeup pipe's ends, if installWakeup made one; close() closes them
+        self.wakeupFds: Optional[Tuple[int,int]] = None
+        self.wakeupLock = threading.Lock()
+        self.installWakeup()
         self.queueHandler()
-        
-        '''
-            This method handles the queue by constantly retrieving
-            tasks from it and accordingly taking the corresponding
-            action.
-            A task could be: game_over, move, prey, score.
-            Each item in the queue is a dictionary whose key is
-            the task type (for example, "move") and its value is
-            the corresponding task value.
-            If the queue.empty exception happens, it schedules 
-            to call itself after a short delay.
-        '''
-    
+
+    def installWakeup(self) -> None:
+        """
+            Arranges for queueHandler to run on the Tk main loop as soon
+            as the game puts a task on an empty queue. Where Tk supports
+            file handlers (not on Windows), the game thread writes a byte
+            to a pipe that Tk watches; otherwise it schedules the handler
+            with after_idle, which tkinter forwards to the main loop.
+        """
+        root = self.gui.root
+        if os.name == "posix" and hasattr(root.tk, "createfilehandler"):
+            readFd, writeFd = os.pipe()
+            os.set_blocking(readFd, False)
+            os.set_blocking(writeFd, False)
+
+            def onReadable(fd: int, mask: int) -> None:
+                try:
+                    os.read(fd, 4096)
+                except BlockingIOError:
+                    pass
+                self.queueHandler()
+
+            def wakeup() -> None:
+                with self.wakeupLock:
+                    if self.wakeupFds is None:
+                        return  # closed; the GUI is gone
+                    try:
+                        os.write(writeFd, b"\0")
+                    except BlockingIOError:
+                        pass  # the pipe is full, so a wakeup is already on its way
+
+            root.tk.createfilehandler(readFd, READABLE, onReadable)
+            self.wakeupFds = (readFd, writeFd)
+            self.queue.wakeup = wakeup
+        else:
+            self.queue.wakeup = lambda: root.after_idle(self.queueHandler)
+
+    def close(self) -> None:
+        """
+            Stops the wakeups and closes the wakeup pipe, if any; called
+            once the GUI has shut down. The game thread may still put tasks.
+        """
+        self.queue.wakeup = None
+        with self.wakeupLock:
+            if self.wakeupFds is None:
+                return
+            readFd, writeFd = self.wakeupFds
+            self.wakeupFds = None
+        try:
+            self.gui.root.tk.deletefilehandler(readFd)
+        except TclError:
+            pass  # the Tk interpreter is already destroyed
+        os.close(readFd)
+        os.close(writeFd)
+
     def queueHandler(self) -> None:
         """
-        Continuously processes tasks from the game's shared queue.
-        This method attempts to retrieve and handle pending tasks such as:
+        Processes every task the game has queued since the last call.
+        It runs on the Tk main loop whenever the queue's wakeup fires.
+        Tasks are coalesced so only the latest state is drawn per frame:
         - game_over: Signal that the game has ended and display the Game Over button.
-        - move: Update the snake's position on the canvas based on the latest snake coordinates.
-        - prey: Move the prey icon to its new coordinates.
-        - score: Update the displayed score when the snake has eaten a prey.
+        - game_won: The snake has filled the board; display the winning button.
+        - keyframe: Redraw the whole snake from a snapshot of its body (the queue
+          has already dropped the moves and keyframes it replaces).
+        - move: Apply one tick's change to the snake: a new head, and the tail
+          removed unless the snake grew.
+        - prey: Move the prey icon to its new coordinates (latest one only).
+        - score: Update the displayed score when the snake has eaten a prey (latest one only).
+        """
+        metrics = self.queue.metrics
+        started = time.perf_counter() if metrics is not None else 0.0
+        tasks = self.queue.drain()
+        prey = score = finished = None
+        preyTasks = scoreTasks = 0
+        for task in tasks:
+            if "move" in task:
+                self.moveSnake(*task["move"])
+            elif "keyframe" in task:
+                self.drawSnake(task["keyframe"])
+            elif "prey" in task:
+                prey = task["prey"]
+                preyTasks += 1
+            elif "score" in task:
+                score = task["score"]
+                scoreTasks += 1
+            elif "game_over" in task:
+                finished = "Game Over!"
+            elif "game_won" in task:
+                finished = "You Win!"
+
+        if prey is not None:
+            self.gui.canvas.coords(self.gui.preyIcon, *prey)
+        if score is not None:
+            self.gui.canvas.itemconfigure(self.gui.score, text=f"Your Score: {score}")
+        if finished is not None:
+            self.gui.gameOver(finished)
+        if metrics is not None and tasks:
+            # Every prey/score task but the latest of each was skipped
+            coalesced = max(0, preyTasks - 1) + max(0, scoreTasks - 1)
+            metrics.recordFrame(tasks, started, time.perf_counter(), coalesced)
+
+    def drawSnake(self, body: Tuple[Tuple[int,int], ...]) -> None:
+        """
+            Replaces all segment items with ones drawn from a keyframe.
+        """
+        canvas = self.gui.canvas
+        for segment in self.segments:
+            canvas.delete(segment)
+        self.segments = deque(self.gui.createSegment(start, end) for start, end in zip(body, body[1:]))
+        self.snakeHead = body[-1]
 
-        If the queue is empty, it schedules itself to run again after a short delay.
-        This ensures that tasks are handled asynchronously as they are produced by 
-        other threads (e.g., the game logic thread).
+    def moveSnake(self, newHead: Tuple[int,int], grew: bool) -> None:
         """
-        try:
-            # Process tasks as long as there are items in the queue.
-            while True:
-                # Attempt to get the next task without waiting.
-                task = self.queue.get_nowait()
-
-                # Check the type of the task and handle it accordingly.
-                if "game_over" in task:
-                    self.gui.gameOver()
-                elif "move" in task:
-                    points = [x for point in task["move"] for x in point]
-                    self.gui.canvas.coords(self.gui.snakeIcon, *points)
-                elif "prey" in task:
-                    self.gui.canvas.coords(self.gui.preyIcon, *task["prey"])
-                elif "score" in task:
-                    self.gui.canvas.itemconfigure(self.gui.score, text=f"Your Score: {task['score']}")
-
-                # Mark the current task as completed.
-                self.queue.task_done()
-
-        except queue.Empty:
-            # No tasks at the moment, re-check after 100ms.
-            self.gui.root.after(100, self.queueHandler)
+            Applies a move delta with a constant number of canvas calls:
+            a grown snake gets a new segment at the head, otherwise the
+            tail segment is moved to the head.
+        """
+        if self.snakeHead is None:
+            # Nothing drawn yet; wait for the next keyframe
+            return
+        if grew:
+            self.segments.append(self.gui.createSegment(self.snakeHead, newHead))
+        else:
+            segment = self.segments.popleft()
+            self.gui.canvas.coords(segment, *self.snakeHead, *newHead)
+            self.segments.append(segment)
+        self.snakeHead = newHead
+
+
+class FreeCellIndex:
+    """
+        Keeps the grid cells a prey may be placed on that are not
+        covered by the snake. The cells are stored in a list together
+        with a dictionary of their positions in it, so taking a cell,
+        releasing it and picking a random free one are all O(1).
+    """
+    def __init__(self, cells: Iterable[Tuple[int,int]]) -> None:
+        self.cells: List[Tuple[int,int]] = list(cells)
+        self.positions: Dict[Tuple[int,int], int] = {cell: i for i, cell in enumerate(self.cells)}
+        self.eligible = frozenset(self.cells)
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def take(self, cell: Tuple[int,int]) -> None:
+        """Marks a cell as covered, moving the last free cell into its slot."""
+        i = self.positions.pop(cell, None)
+        if i is None:
+            return
+        last = self.cells.pop()
+        if i < len(self.cells):
+            self.cells[i] = last
+            self.positions[last] = i
+
+    def release(self, cell: Tuple[int,int]) -> None:
+        """Marks a cell as free again if prey may be placed on it."""
+        if cell in self.eligible and cell not in self.positions:
+            self.positions[cell] = len(self.cells)
+            self.cells.append(cell)
+
+    def pick(self, rng: random.Random) -> Optional[Tuple[int,int]]:
+        """Returns a random free cell, or None when the board is full."""
+        if not self.cells:
+            return None
+        return self.cells[rng.randrange(len(self.cells))]
+
+
+class TickScheduler:
+    """
+        This class runs a tick function at a fixed timestep measured on
+        the monotonic clock. Tick n is due one period after tick n - 1 was
+        due (not after it finished), so the work time and sleep overshoot
+        of one tick do not push back the following ones.
+        When ticks fall behind, policy decides what happens:
+        - "catchup": the missed ticks run back to back, at most maxCatchUp
+          of them; beyond that the schedule restarts from now.
+        - "skip": missed whole periods are dropped and the late tick runs
+          once.
+        setPeriod() may be called from any thread (or from the tick itself)
+        to change the rate from the next tick on. Tick jitter (how late each
+        tick started against its due time) is summarized by jitterStats().
+    """
+    def __init__(self, period: float, policy: str = "catchup", maxCatchUp: int = 5,
+                 jitterSamples: int = 1000) -> None:
+        if policy not in ("catchup", "skip"):
+            raise ValueError(f"unknown tick policy: {policy}")
+        self.period = period
+        self.policy = policy
+        self.maxCatchUp = maxCatchUp
+        self.stopped = threading.Event()
+        self.ticks = 0
+        self.skipped = 0
+        self.caughtUp = 0
+        self.maxJitter = 0.0
+        self.totalJitter = 0.0
+        self.recentJitter: Deque[float] = deque(maxlen=jitterSamples)
+
+    def setPeriod(self, period: float) -> None:
+        self.period = period
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def run(self, tick: Callable[[], bool]) -> None:
+        """
+            Calls tick on schedule until it returns False or stop() is called.
+        """
+        dueTime = time.monotonic()
+        behindRun = 0
+        while not self.stopped.is_set():
+            now = time.monotonic()
+            if now < dueTime:
+                # Event.wait doubles as an interruptible sleep
+                self.stopped.wait(dueTime - now)
+                continue
+            self.recordJitter(now - dueTime)
+            if not tick():
+                return
+
+            period = self.period
+            dueTime += period
+            behind = time.monotonic() - dueTime
+            if behind < period:
+                behindRun = 0
+            elif self.policy == "skip":
+                missed = int(behind // period)
+                dueTime += missed * period
+                self.skipped += missed
+            elif behindRun < self.maxCatchUp:
+                behindRun += 1
+                self.caughtUp += 1
+            else:
+                self.skipped += int(behind // period)
+                dueTime = time.monotonic()
+                behindRun = 0
+
+    def recordJitter(self, jitter: float) -> None:
+        self.ticks += 1
+        self.totalJitter += jitter
+        self.maxJitter = max(self.maxJitter, jitter)
+        self.recentJitter.append(jitter)
+
+    def jitterStats(self) -> Dict[str, float]:
+        """
+            Returns tick counts and jitter in seconds: mean and max over all
+            ticks, percentiles over the most recent ones.
+        """
+        recent = sorted(self.recentJitter)
+
+        def percentile(p: float) -> float:
+            return recent[min(len(recent) - 1, int(p * len(recent)))] if recent else 0.0
+
+        return {
+            "ticks": self.ticks,
+            "skipped": self.skipped,
+            "caughtUp": self.caughtUp,
+            "period": self.period,
+            "mean": self.totalJitter / self.ticks if self.ticks else 0.0,
+            "max": self.maxJitter,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+        }
 
 
 class Game:
     '''
         This class implements most of the game functionalities.
     '''
-    def __init__(self) -> None:
+    def __init__(self, taskQueue: TaskQueue, rng: Optional[random.Random] = None,
+                 metrics: Optional[PipelineMetrics] = None) -> None:
         """
            This initializer sets the initial snake coordinate list, movement
            direction, and arranges for the first prey to be created.
+           Tasks for the GUI are put on taskQueue; prey placement draws
+           from rng, so a seeded Random makes a game reproducible.
+           If metrics is given, superloop records how long each move takes.
         """
-        self.queue: queue.Queue = gameQueue
+        self.queue: TaskQueue = taskQueue
+        self.rng: random.Random = rng if rng is not None else random.Random()
+        self.metrics = metrics
         self.score: int = 0
         # Starting snake coordinates (treat these as centers of each segment)
-        self.snakeCoordinates: List[Tuple[int,int]] = [(495, 55), (480, 55), (465, 55), (450, 55), (435, 55)]
+        self.snakeCoordinates: Deque[Tuple[int,int]] = deque([(495, 55), (480, 55), (465, 55), (450, 55), (435, 55)])
+        # Cells currently covered by the body, kept in step with snakeCoordinates
+        # so that collision checks do not have to scan the whole snake
+        self.occupiedCells: Set[Tuple[int,int]] = set(self.snakeCoordinates)
+        # Cells still available for the prey, maintained alongside occupiedCells
+        self.freeCells = FreeCellIndex(self.calculatePreyCells())
+        for cell in self.snakeCoordinates:
+            self.freeCells.take(cell)
         self.direction: str = "Left"
         self.gameNotOver: bool = True
         self.preyCoordinates: Tuple[int,int,int,int] = (0,0,0,0)
+        self.ticks: int = 0
+        self.scheduler: Optional[TickScheduler] = None
+        # "game_over" or "game_won" task, queued by move() after the final keyframe
+        self.endTask: Optional[dict] = None
         self.createNewPrey()
+        self.queue.put({"keyframe": tuple(self.snakeCoordinates)})
+        if self.endTask is not None:
+            self.queue.put(self.endTask)
 
     def superloop(self) -> None:
         """
@@ -131,11 +576,28 @@ class Game:
             tasks to cause the constant movement of the snake.
             Use the SPEED constant to set how often the move tasks
             are generated.
+            Ticks are timed by a TickScheduler so the rate stays steady
+            under load, and every SPEED_UP_EVERY points the period shrinks
+            by SPEED_UP_FACTOR, down to MIN_SPEED.
         """
         SPEED = 0.15
-        while self.gameNotOver:
-            self.move()
-            time.sleep(SPEED)
+        SPEED_UP_EVERY = 5
+        SPEED_UP_FACTOR = 0.9
+        MIN_SPEED = 0.06
+        self.scheduler = TickScheduler(SPEED)
+
+        def tick() -> bool:
+            if self.metrics is not None:
+                started = time.perf_counter()
+                self.move()
+                self.metrics.recordMove(time.perf_counter() - started)
+            else:
+                self.move()
+            level = self.score // SPEED_UP_EVERY
+            self.scheduler.setPeriod(max(MIN_SPEED, SPEED * SPEED_UP_FACTOR ** level))
+            return self.gameNotOver
+
+        self.scheduler.run(tick)
 
     def whenAnArrowKeyIsPressed(self, e: Event) -> None:
         """ 
@@ -145,14 +607,22 @@ class Game:
             the key that was pressed by the gamer.
             Use as is.
         """
+        self.changeDirection(e.keysym)
+
+    def changeDirection(self, keysym: str) -> None:
+        """
+            This method sets the movement direction to the given
+            arrow key name, ignoring a reversal onto the snake itself.
+            It is shared by the key binding and the headless engine.
+        """
         currentDirection = self.direction
         # Prevent reverse direction
-        if (currentDirection == "Left" and e.keysym == "Right" or 
-            currentDirection == "Right" and e.keysym == "Left" or
-            currentDirection == "Up" and e.keysym == "Down" or
-            currentDirection == "Down" and e.keysym == "Up"):
+        if (currentDirection == "Left" and keysym == "Right" or 
+            currentDirection == "Right" and keysym == "Left" or
+            currentDirection == "Up" and keysym == "Down" or
+            currentDirection == "Down" and keysym == "Up"):
             return
-        self.direction = e.keysym
+        self.direction = keysym
 
     def move(self) -> None:
         """ 
@@ -166,11 +636,29 @@ class Game:
             the game should be over. 
             The snake coordinates list (representing its length 
             and position) should be correctly updated.
+            The GUI is sent only what changed, a "move" task with the
+            new head and whether the snake grew, plus a "keyframe" copy
+            of the whole body every KEYFRAME_INTERVAL ticks or when the
+            queue had to drop moves and asks for one. The tick that ends
+            the game always sends a keyframe, then the end task, so the
+            last frame drawn is complete.
         """
         newHead = self.calculateNewCoordinates()
+        preyCaptured = self.checkPreyCollision(newHead)
+
+        if not preyCaptured:
+            # No prey captured, remove tail (its cell is free again before
+            # the head moves in, so chasing the tail is allowed)
+            tail = self.snakeCoordinates.popleft()
+            self.occupiedCells.discard(tail)
+            self.freeCells.release(tail)
+            self.isGameOver(newHead)
+
         self.snakeCoordinates.append(newHead)
+        self.occupiedCells.add(newHead)
+        self.freeCells.take(newHead)
 
-        if self.checkPreyCollision(newHead):
+        if preyCaptured:
             # Increase score
             self.score += 1
             self.queue.put({"score": self.score})
@@ -178,13 +666,15 @@ class Game:
             # Create a new prey immediately
             self.createNewPrey()
 
-            # Update snake position (so GUI reflects the longer snake)
-            self.queue.put({"move": self.snakeCoordinates})
+        # Update snake position (so GUI reflects the new head and tail); tasks
+        # only hold immutable values, never the live snakeCoordinates
+        self.ticks += 1
+        if self.endTask is None and self.ticks % KEYFRAME_INTERVAL and not self.queue.wantsKeyframe():
+            self.queue.put({"move": (newHead, preyCaptured)})
         else:
-            # No prey captured, remove tail
-            self.snakeCoordinates.pop(0)
-            self.isGameOver(newHead)
-            self.queue.put({"move": self.snakeCoordinates})
+            self.queue.put({"keyframe": tuple(self.snakeCoordinates)})
+        if self.endTask is not None:
+            self.queue.put(self.endTask)
 
     def calculateNewCoordinates(self) -> Tuple[int,int]:
         """
@@ -212,44 +702,65 @@ class Game:
             checking if now the snake has passed any wall
             or if it has bit itself.
             If that is the case, it updates the gameNotOver 
-            field and also adds a "game_over" task to the queue. 
+            field and also sets the "game_over" task that move()
+            adds to the queue after the final keyframe.
+            It must be called before the new head is added to
+            occupiedCells, so a hit is a set lookup instead of
+            a scan over the body.
         """
         x, y = snakeCoordinates
         # Check wall collision
         if x < 0 or x >= WINDOW_WIDTH or y < 0 or y >= WINDOW_HEIGHT:
             self.gameNotOver = False
-            self.queue.put({"game_over": True})
+            self.endTask = {"game_over": True}
             return
         # Check self collision
-        if snakeCoordinates in self.snakeCoordinates[:-1]:
+        if snakeCoordinates in self.occupiedCells:
             self.gameNotOver = False
-            self.queue.put({"game_over": True})
+            self.endTask = {"game_over": True}
+
+    def calculatePreyCells(self) -> List[Tuple[int,int]]:
+        """
+            This method returns every cell the prey may be placed on:
+            the centres of the grid the snake moves on (anchored at its
+            starting head) that are at least THRESHOLD away from the walls.
+        """
+        half_prey = PREY_ICON_WIDTH // 2
+        THRESHOLD = 15
+        originX, originY = self.snakeCoordinates[-1]
+        firstX = originX % SNAKE_ICON_WIDTH
+        firstY = originY % SNAKE_ICON_WIDTH
+        return [
+            (px, py)
+            for py in range(firstY, WINDOW_HEIGHT, SNAKE_ICON_WIDTH)
+            if THRESHOLD + half_prey <= py <= WINDOW_HEIGHT - THRESHOLD - half_prey
+            for px in range(firstX, WINDOW_WIDTH, SNAKE_ICON_WIDTH)
+            if THRESHOLD + half_prey <= px <= WINDOW_WIDTH - THRESHOLD - half_prey
+        ]
 
     def createNewPrey(self) -> None:
         """ 
-            This method picks an x and a y randomly as the coordinate 
-            of the new prey and uses that to calculate the 
-            coordinates (x - 5, y - 5, x + 5, y + 5). [you need to replace 5 with a constant]
+            This method picks a random free cell from freeCells as the
+            centre (x, y) of the new prey and uses that to calculate the
+            coordinates (x - half_prey, y - half_prey, x + half_prey, y + half_prey).
             It then adds a "prey" task to the queue with the calculated
             rectangle coordinates as its value. This is used by the 
             queue handler to represent the new prey.                    
-            To make playing the game easier, set the x and y to be THRESHOLD
-            away from the walls. 
+            Only cells THRESHOLD away from the walls are in freeCells.
+            If no free cell is left the snake has filled the board, so
+            the game ends and the "game_won" task is set for move() to
+            add to the queue after the final keyframe.
         """
         half_prey = PREY_ICON_WIDTH // 2
-        THRESHOLD = 15 
-        while True:
-            px = random.randint(THRESHOLD + half_prey, WINDOW_WIDTH - THRESHOLD - half_prey)
-            py = random.randint(THRESHOLD + half_prey, WINDOW_HEIGHT - THRESHOLD - half_prey)
-
-            overlap = any(
-                abs(segmentX - px) < PREY_ICON_WIDTH and abs(segmentY - py) < PREY_ICON_WIDTH 
-                for segmentX, segmentY in self.snakeCoordinates
-            )
-            if not overlap:
-                self.preyCoordinates = (px - half_prey, py - half_prey, px + half_prey, py + half_prey)
-                self.queue.put({"prey": self.preyCoordinates})
-                break
+        cell = self.freeCells.pick(self.rng)
+        if cell is None:
+            self.preyCoordinates = (0, 0, 0, 0)
+            self.gameNotOver = False
+            self.endTask = {"game_won": True}
+            return
+        px, py = cell
+        self.preyCoordinates = (px - half_prey, py - half_prey, px + half_prey, py + half_prey)
+        self.queue.put({"prey": self.preyCoordinates})
 
     def checkPreyCollision(self, head: Tuple[int,int]) -> bool:
         headX, headY = head
@@ -265,15 +776,110 @@ class Game:
         return (sx1 < px2 and sx2 > px1 and sy1 < py2 and sy2 > py1)
 
 
+class DiscardQueue:
+    """
+        Stands in for the game queue when there is no GUI:
+        tasks are accepted and thrown away.
+    """
+    def put(self, task: dict) -> None:
+        pass
+
+    def wantsKeyframe(self) -> bool:
+        return False
+
+
+class HeadlessEngine:
+    """
+        This class runs the game logic without Tk and without sleeping
+        between ticks, for soak tests, bots and benchmarks.
+        Input is injected either per step or through a controller that
+        is given the game before every tick and returns an arrow key
+        name (or None to keep going straight). All randomness comes
+        from a Random seeded with seed, so runs are reproducible.
+    """
+    def __init__(self, seed: Optional[int] = None,
+                 controller: Optional[Callable[["Game"], Optional[str]]] = None,
+                 taskQueue=None) -> None:
+        self.rng = random.Random(seed)
+        self.game = Game(taskQueue if taskQueue is not None else DiscardQueue(), self.rng)
+        self.controller = controller
+        self.ticks = 0
+
+    def step(self, key: Optional[str] = None) -> bool:
+        """
+            Advances the game by one tick, steering with key (or the
+            controller when no key is given). Returns whether the game
+            is still running.
+        """
+        game = self.game
+        if not game.gameNotOver:
+            return False
+        if key is None and self.controller is not None:
+            key = self.controller(game)
+        if key is not None:
+            game.changeDirection(key)
+        game.move()
+        self.ticks += 1
+        return game.gameNotOver
+
+    def run(self, maxTicks: int) -> int:
+        """
+            Steps until the game ends or maxTicks ticks have run and
+            returns the number of ticks that were run.
+        """
+        game = self.game
+        controller = self.controller
+        move = game.move
+        ticks = 0
+        while ticks < maxTicks and game.gameNotOver:
+            if controller is not None:
+                key = controller(game)
+                if key is not None:
+                    game.changeDirection(key)
+            move()
+            ticks += 1
+        self.ticks += ticks
+        return ticks
+
+
+def runHeadless(games: int, maxTicks: int) -> None:
+    """
+        Plays seeded games with a random controller and prints the
+        tick rate reached, e.g. python part1.py --headless 1000
+    """
+    keys = ("Left", "Right", "Up", "Down")
+    totalTicks = 0
+    start = time.perf_counter()
+    for seed in range(games):
+        steer = random.Random(seed)
+        engine = HeadlessEngine(seed, lambda game: steer.choice(keys) if steer.random() < 0.2 else None)
+        totalTicks += engine.run(maxTicks)
+    elapsed = time.perf_counter() - start
+    print(f"{games} games, {totalTicks} ticks in {elapsed:.3f}s ({totalTicks / elapsed:,.0f} ticks/s)")
+
+
 if __name__ == "__main__":
-    gameQueue = queue.Queue()
-    game = Game()
-    gui = Gui()
-    QueueHandler()
+    if len(sys.argv) > 1 and sys.argv[1] == "--headless":
+        runHeadless(int(sys.argv[2]) if len(sys.argv) > 2 else 1000, 100000)
+        sys.exit()
+
+    # Set SNAKE_METRICS=<file> to record pipeline latency histograms,
+    # written to that file as JSON when the window is closed
+    metricsPath = os.environ.get("SNAKE_METRICS")
+    metrics = PipelineMetrics() if metricsPath else None
+
+    gameQueue = TaskQueue(metrics=metrics)
+    game = Game(gameQueue, metrics=metrics)
+    gui = Gui(game)
+    queueHandler = QueueHandler(gui, gameQueue)
 
     # Start game loop in separate thread
     threading.Thread(target=game.superloop, daemon=True).start()
 
     # Start GUI loop
     gui.root.mainloop()
+    queueHandler.close()
+
+    if metrics is not None:
+        metrics.dump(metricsPath, gameQueue, game.scheduler)
 
@@ -14,14 +14,16 @@ ICON_COLOUR = "yellow"
     game (https://en.wikipedia.org/wiki/Snake_(video_game_genre))
 
     Instead of using queueing like in part 1, part 1 alternative uses an event handler instead. Shared data 
-    is stored in a dictionary seperate from the events, each task is an event created by threading.Event()
+    is stored in a dictionary of versioned payloads guarded by one threading.Condition; the gui waits on
+    it for any task and draws the latest payloads on the Tk main loop
 """
 
 import threading
 #import queue 
 
-from tkinter import Tk, Canvas, Button
+from tkinter import Tk, Canvas, Button, TclError
 import random, time
+from collections import deque
 
 class Gui():
     """
@@ -59,33 +61,63 @@ class Gui():
         for key in ("Left", "Right", "Up", "Down"):
             self.root.bind(f"<Key-{key}>", game.whenAnArrowKeyIsPressed)
 
+        # Versions of each task type already drawn, and whether the main
+        # loop has finished drawing the last batch of updates
+        self.seen = dict.fromkeys(EventHandler.TASK_TYPES, 0)
+        self.frame_done = threading.Event()
+        self.frame_done.set()
+        # Set by the main loop once it runs; tkinter refuses calls from other
+        # threads before that as well as after it has ended
+        self.main_loop_started = threading.Event()
+        self.root.after_idle(self.main_loop_started.set)
+
         # Thread for the event handler
         threading.Thread(target=self.event_handler_loop, daemon=True).start()
 
-    # Updates gui according to eventHandler
+    # Waits for the game to set any task and passes the new payloads to the main loop
     def event_handler_loop(self):
+        """
+            Blocks (without polling) until the game sets any task, then
+            hands the newer payloads to the Tk main loop, where all canvas
+            calls are made. It waits for that frame to be drawn before
+            taking the next updates, so whatever arrives meanwhile is
+            drawn together in the following frame.
+        """
+        seen = dict(self.seen)
         while True:
-            if self.event_handler.move_event.is_set():
-                data = self.event_handler.get_task_data("move")
-                points = [x for point in data for x in point]
-                self.canvas.coords(self.snakeIcon, *points)
-                self.event_handler.clear_event(self.event_handler.move_event)
-
-            if self.event_handler.prey_event.is_set():
-                data = self.event_handler.get_task_data("prey")
-                self.canvas.coords(self.preyIcon, *data)
-                self.event_handler.clear_event(self.event_handler.prey_event)
-
-            if self.event_handler.score_event.is_set():
-                data = self.event_handler.get_task_data("score")
-                self.canvas.itemconfigure(self.score, text=f"Your Score: {data}")
-                self.event_handler.clear_event(self.event_handler.score_event)
-
-            if self.event_handler.game_over_event.is_set():
-                self.gameOver()
-                self.event_handler.clear_event(self.event_handler.game_over_event)
-
-            time.sleep(0.05)
+            self.frame_done.wait()
+            updates = self.event_handler.wait_for_any(seen)
+            for event_type, (version, data) in updates.items():
+                seen[event_type] = version
+            self.frame_done.clear()
+            while True:
+                try:
+                    # tkinter runs this on the main loop's thread
+                    self.root.after_idle(self.apply_updates, updates)
+                    break
+                except TclError:
+                    return  # the window was destroyed (Game Over button)
+                except RuntimeError:
+                    if self.main_loop_started.is_set():
+                        return  # the main loop has ended
+                    # the main loop has not started yet; try again once it has
+                    self.main_loop_started.wait()
+
+    # Draws one batch of updates; runs on the main loop
+    def apply_updates(self, updates):
+        for event_type, (version, data) in updates.items():
+            self.seen[event_type] = version
+        if "move" in updates:
+            data = updates["move"][1]
+            points = [x for point in data for x in point]
+            self.canvas.coords(self.snakeIcon, *points)
+        if "prey" in updates:
+            self.canvas.coords(self.preyIcon, *updates["prey"][1])
+        if "score" in updates:
+            self.canvas.itemconfigure(self.score, text=f"Your Score: {updates['score'][1]}")
+        if "game_over" in updates:
+            self.gameOver()
+        self.frame_done.set()
 
     def gameOver(self):
         """
@@ -99,39 +131,50 @@ class Gui():
     
 
 class EventHandler:
+    """
+        Carries tasks from the game thread to the gui. There is one
+        condition for all task types: set_task stores the latest payload
+        of a type with a version number counting how often that type was
+        set, and wakes anyone blocked in wait_for_any. Payloads must not
+        be changed after they are set (the game sends tuples).
+    """
+    TASK_TYPES = ("move", "prey", "score", "game_over")
+
     def __init__(self):
-        # Define events
-        self.move_event = threading.Event()
-        self.prey_event = threading.Event()
-        self.score_event = threading.Event()
-        self.game_over_event = threading.Event()
-        
-        # Lock for shared data
-        self.lock = threading.Lock()
+        # One condition (and its lock) guards the shared data
+        self.condition = threading.Condition()
         
-        # Shared data
+        # Shared data: event type -> (version, payload)
         self.shared_data = {}
+        self.versions = dict.fromkeys(self.TASK_TYPES, 0)
 
     def set_task(self, event_type, data=None):
-        with self.lock:
-            self.shared_data[event_type] = data
-        if event_type == "move":
-            self.move_event.set()
-        elif event_type == "prey":
-            self.prey_event.set()
-        elif event_type == "score":
-            self.score_event.set()
-        elif event_type == "game_over":
-            self.game_over_event.set()
-
-    # Gets data for task
-    def get_task_data(self, event_type):
-        with self.lock:
-            return self.shared_data.get(event_type, None)
-
-    # Resets
-    def clear_event(self, event):
-        event.clear()
+        with self.condition:
+            version = self.versions[event_type] + 1
+            self.versions[event_type] = version
+            self.shared_data[event_type] = (version, data)
+            self.condition.notify_all()
+
+    # Blocks until any task is newer than the versions in seen
+    def wait_for_any(self, seen, timeout=None):
+        """
+            Returns {event_type: (version, payload)} for every task type
+            whose version is newer than seen[event_type], waiting until
+            there is at least one. The difference between versions tells
+            how many updates were coalesced. Returns an empty dict if
+            timeout (seconds) runs out first.
+        """
+        with self.condition:
+            updates = self._newer_than(seen)
+            while not updates:
+                if not self.condition.wait(timeout):
+                    return {}
+                updates = self._newer_than(seen)
+            return updates
+
+    def _newer_than(self, seen):
+        return {event_type: entry for event_type, entry in self.shared_data.items()
+                if entry[0] > seen.get(event_type, 0)}
 
 
 class Game():
@@ -149,8 +192,11 @@ class Game():
         #starting length and location of the snake
         #note that it is a list of tuples, each being an
         # (x, y) tuple. Initially its size is 5 tuples.       
-        self.snakeCoordinates = [(495, 55), (485, 55), (475, 55),
-                                 (465, 55), (455, 55)]
+        self.snakeCoordinates = deque([(495, 55), (485, 55), (475, 55),
+                                       (465, 55), (455, 55)])
+        #cells covered by the body, updated on every head append and
+        #tail pop so collision checks are a set lookup
+        self.occupiedCells = set(self.snakeCoordinates)
         #initial direction of the snake
         self.direction = "Left"
         self.gameNotOver = True
@@ -203,10 +249,12 @@ class Game():
         # Calculate the new head coordinates
         NewSnakeCoordinates = self.calculateNewCoordinates()
 
+        # Check for collisions before the head is marked as occupied
+        self.isGameOver(NewSnakeCoordinates)
+
         # Append the new coordinates to the snake's body
         self.snakeCoordinates.append(NewSnakeCoordinates)
-
-        self.isGameOver(NewSnakeCoordinates)
+        self.occupiedCells.add(NewSnakeCoordinates)
 
         # Check if prey is captured
         preyLeft = self.preyCoordinates[0]
@@ -233,9 +281,10 @@ class Game():
 
         else:
             # Remove the tail if no prey is captured
-            self.snakeCoordinates.pop(0)
+            self.occupiedCells.discard(self.snakeCoordinates.popleft())
 
-        self.event_handler.set_task("move", self.snakeCoordinates)
+        # Send a copy, the gui thread cannot iterate the deque while it changes
+        self.event_handler.set_task("move", tuple(self.snakeCoordinates))
 
     def calculateNewCoordinates(self) -> tuple:
         """
@@ -270,6 +319,7 @@ class Game():
             or if it has bit itself.
             If that is the case, it updates the gameNotOver 
             field and also adds a "game_over" task to the queue. 
+            It is called before the new head is added to occupiedCells.
         """
         x, y = snakeCoordinates
         # Check wall collisions
@@ -280,7 +330,7 @@ class Game():
             return
 
         # Check self-collision
-        if snakeCoordinates in self.snakeCoordinates[:-1]:
+        if snakeCoordinates in self.occupiedCells:
             self.gameNotOver = False
             self.event_handler.set_task("game_over")
 
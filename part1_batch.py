@@ -0,0 +1,235 @@
+"""
+    Batched version of the snake game logic in part1.py.
+
+    BatchGame advances many independent games per step. Head positions,
+    directions, bodies (as ring buffers of cell ids), occupancy bitmaps,
+    free prey cells and prey boxes are NumPy arrays, and the wall, self
+    and prey collision checks are array operations over all games.
+    Every game follows exactly the rules of Game.move / isGameOver /
+    checkPreyCollision, and game i draws its prey from random.Random(seeds[i])
+    just like HeadlessEngine(seeds[i]), so both produce the same games.
+
+    NumPy is only needed for this module; part1.py does not depend on it.
+"""
+
+import random
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import part1
+from part1 import WINDOW_WIDTH, WINDOW_HEIGHT, SNAKE_ICON_WIDTH, PREY_ICON_WIDTH
+
+# Direction codes used in the direction and key arrays (-1 in a key array
+# means "no key pressed")
+DIRECTIONS = ("Left", "Right", "Up", "Down")
+OPPOSITE = np.array([1, 0, 3, 2])
+STEP_X = np.array([-SNAKE_ICON_WIDTH, SNAKE_ICON_WIDTH, 0, 0])
+STEP_Y = np.array([0, 0, -SNAKE_ICON_WIDTH, SNAKE_ICON_WIDTH])
+
+
+class BatchGame:
+    """
+        This class holds N games and moves all of them one tick per step().
+        Games that are over stay frozen while the others keep running.
+    """
+    def __init__(self, seeds: Sequence[int]) -> None:
+        """
+            The initializer lays out the board grid from a reference Game
+            (so start position, grid and prey cells match part1 exactly),
+            copies its starting state into every row and then places the
+            first prey of each game with that game's own Random.
+        """
+        reference = part1.Game(part1.DiscardQueue(), random.Random(0))
+        self.n = len(seeds)
+        self.rngs = [random.Random(seed) for seed in seeds]
+
+        # Board grid: cell id = row * columns + column
+        originX, originY = reference.snakeCoordinates[-1]
+        self.firstX = originX % SNAKE_ICON_WIDTH
+        self.firstY = originY % SNAKE_ICON_WIDTH
+        self.columns = len(range(self.firstX, WINDOW_WIDTH, SNAKE_ICON_WIDTH))
+        self.rows = len(range(self.firstY, WINDOW_HEIGHT, SNAKE_ICON_WIDTH))
+        cellCount = self.columns * self.rows
+        rowIndex = np.arange(self.n)
+
+        # Snake bodies as ring buffers; one spare slot for the head that
+        # bites the body on the final tick
+        self.capacity = cellCount + 1
+        start = [self.cellOf(point) for point in reference.snakeCoordinates]
+        self.body = np.zeros((self.n, self.capacity), dtype=np.int32)
+        self.body[:, :len(start)] = start
+        self.tail = np.zeros(self.n, dtype=np.int64)
+        self.length = np.full(self.n, len(start), dtype=np.int64)
+        self.occupied = np.zeros((self.n, cellCount), dtype=bool)
+        self.occupied[:, start] = True
+        self.headX = np.full(self.n, originX, dtype=np.int64)
+        self.headY = np.full(self.n, originY, dtype=np.int64)
+        self.direction = np.full(self.n, DIRECTIONS.index(reference.direction), dtype=np.int64)
+
+        # Free prey cells in the same order as the reference FreeCellIndex
+        free = [self.cellOf(cell) for cell in reference.freeCells.cells]
+        self.eligible = np.zeros(cellCount, dtype=bool)
+        self.eligible[[self.cellOf(cell) for cell in reference.freeCells.eligible]] = True
+        self.freeCells = np.zeros((self.n, cellCount), dtype=np.int32)
+        self.freeCells[:, :len(free)] = free
+        self.freePositions = np.full((self.n, cellCount), -1, dtype=np.int64)
+        self.freePositions[:, free] = np.arange(len(free))
+        self.freeCount = np.full(self.n, len(free), dtype=np.int64)
+
+        self.score = np.zeros(self.n, dtype=np.int64)
+        self.gameNotOver = np.ones(self.n, dtype=bool)
+        self.gameWon = np.zeros(self.n, dtype=bool)
+        self.preyCoordinates = np.zeros((self.n, 4), dtype=np.int64)
+        self.ticks = 0
+        self.createNewPrey(rowIndex)
+
+    def cellOf(self, point: Tuple[int, int]) -> int:
+        x, y = point
+        return (y - self.firstY) // SNAKE_ICON_WIDTH * self.columns + (x - self.firstX) // SNAKE_ICON_WIDTH
+
+    def pointOf(self, cell: int) -> Tuple[int, int]:
+        row, column = divmod(int(cell), self.columns)
+        return self.firstX + column * SNAKE_ICON_WIDTH, self.firstY + row * SNAKE_ICON_WIDTH
+
+    def snakeCoordinates(self, i: int) -> List[Tuple[int, int]]:
+        """
+            Returns game i's body as part1 stores it, tail first. A game
+            that ended on a wall keeps its last on-board body; the head
+            that left the board is in headX/headY.
+        """
+        slots = (self.tail[i] + np.arange(self.length[i])) % self.capacity
+        return [self.pointOf(cell) for cell in self.body[i, slots]]
+
+    def changeDirection(self, keys: np.ndarray) -> None:
+        """
+            Applies one arrow key per game (-1 for none), ignoring
+            reversals exactly like Game.changeDirection.
+        """
+        keys = np.asarray(keys)
+        turn = (keys >= 0) & (keys != OPPOSITE[self.direction]) & self.gameNotOver
+        self.direction[turn] = keys[turn]
+
+    def step(self, keys: Optional[np.ndarray] = None) -> int:
+        """
+            Moves every running game one tick, after applying keys if given.
+            Returns the number of games still running.
+        """
+        if keys is not None:
+            self.changeDirection(keys)
+        games = np.flatnonzero(self.gameNotOver)
+        if games.size == 0:
+            return 0
+        self.ticks += 1
+
+        direction = self.direction[games]
+        newX = self.headX[games] + STEP_X[direction]
+        newY = self.headY[games] + STEP_Y[direction]
+        captured = self.checkPreyCollision(games, newX, newY)
+
+        # No prey captured: free the tail cell before the head moves in
+        grow = games[captured]
+        moving = games[~captured]
+        tailCells = self.body[moving, self.tail[moving]]
+        self.occupied[moving, tailCells] = False
+        self.releaseFreeCells(moving, tailCells)
+        self.tail[moving] = (self.tail[moving] + 1) % self.capacity
+        self.length[moving] -= 1
+        self.isGameOver(moving, newX[~captured], newY[~captured])
+
+        # Add the new head; heads that left the board only move headX/headY
+        self.headX[games] = newX
+        self.headY[games] = newY
+        onBoard = (newX >= 0) & (newX < WINDOW_WIDTH) & (newY >= 0) & (newY < WINDOW_HEIGHT)
+        placed = games[onBoard]
+        headCells = ((newY[onBoard] - self.firstY) // SNAKE_ICON_WIDTH * self.columns
+                     + (newX[onBoard] - self.firstX) // SNAKE_ICON_WIDTH).astype(np.int32)
+        self.body[placed, (self.tail[placed] + self.length[placed]) % self.capacity] = headCells
+        self.length[placed] += 1
+        self.occupied[placed, headCells] = True
+        self.takeFreeCells(placed, headCells)
+
+        if grow.size:
+            self.score[grow] += 1
+            self.createNewPrey(grow)
+        return int(np.count_nonzero(self.gameNotOver))
+
+    def run(self, maxTicks: int, controller=None) -> int:
+        """
+            Steps until every game is over or maxTicks steps have run.
+            controller, if given, is called with this BatchGame before each
+            step and returns a key array (or None). Returns the steps run.
+        """
+        for tick in range(maxTicks):
+            keys = controller(self) if controller is not None else None
+            if self.step(keys) == 0:
+                return tick + 1
+        return maxTicks
+
+    def checkPreyCollision(self, games: np.ndarray, newX: np.ndarray, newY: np.ndarray) -> np.ndarray:
+        """Box overlap of each new head with its game's prey, as in Game.checkPreyCollision."""
+        half_snake = SNAKE_ICON_WIDTH // 2
+        prey = self.preyCoordinates[games]
+        return ((newX - half_snake < prey[:, 2]) & (newX + half_snake > prey[:, 0]) &
+                (newY - half_snake < prey[:, 3]) & (newY + half_snake > prey[:, 1]))
+
+    def isGameOver(self, games: np.ndarray, newX: np.ndarray, newY: np.ndarray) -> None:
+        """
+            Ends the games whose new head is off the board or on a cell
+            that is still occupied (the tails are already released).
+        """
+        wall = (newX < 0) | (newX >= WINDOW_WIDTH) | (newY < 0) | (newY >= WINDOW_HEIGHT)
+        inside = ~wall
+        bitten = np.zeros_like(wall)
+        cells = ((newY[inside] - self.firstY) // SNAKE_ICON_WIDTH * self.columns
+                 + (newX[inside] - self.firstX) // SNAKE_ICON_WIDTH)
+        bitten[inside] = self.occupied[games[inside], cells]
+        self.gameNotOver[games[wall | bitten]] = False
+
+    def takeFreeCells(self, games: np.ndarray, cells: np.ndarray) -> None:
+        """Vectorized FreeCellIndex.take: at most one cell per game."""
+        positions = self.freePositions[games, cells]
+        listed = positions >= 0
+        games, cells, positions = games[listed], cells[listed], positions[listed]
+        self.freeCount[games] -= 1
+        last = self.freeCells[games, self.freeCount[games]]
+        self.freeCells[games, positions] = last
+        self.freePositions[games, last] = positions
+        self.freePositions[games, cells] = -1
+
+    def releaseFreeCells(self, games: np.ndarray, cells: np.ndarray) -> None:
+        """Vectorized FreeCellIndex.release: at most one cell per game."""
+        released = self.eligible[cells] & (self.freePositions[games, cells] < 0)
+        games, cells = games[released], cells[released]
+        self.freeCells[games, self.freeCount[games]] = cells
+        self.freePositions[games, cells] = self.freeCount[games]
+        self.freeCount[games] += 1
+
+    def createNewPrey(self, games: np.ndarray) -> None:
+        """
+            Places a new prey for each of the given games with that game's
+            Random, or ends the game as won when its board is full. Only
+            games that just ate are passed in, so this loop is short.
+        """
+        half_prey = PREY_ICON_WIDTH // 2
+        for i in games.tolist():
+            count = int(self.freeCount[i])
+            if count == 0:
+                self.preyCoordinates[i] = (0, 0, 0, 0)
+                self.gameNotOver[i] = False
+                self.gameWon[i] = True
+                continue
+            px, py = self.pointOf(self.freeCells[i, self.rngs[i].randrange(count)])
+            self.preyCoordinates[i] = (px - half_prey, py - half_prey, px + half_prey, py + half_prey)
+
+
+if __name__ == "__main__":
+    import sys, time
+
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    steer = np.random.default_rng(0)
+    batch = BatchGame(range(games))
+    start = time.perf_counter()
+    steps = batch.run(100000, lambda b: np.where(steer.random(b.n) < 0.2, steer.integers(0, 4, b.n), -1))
+    elapsed = time.perf_counter() - start
+    print(f"{games} games, {steps} steps in {elapsed:.3f}s, max score {batch.score.max()}")
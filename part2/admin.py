@@ -0,0 +1,288 @@
+#Content of admin.py; live metrics and admin socket of the chat server
+
+"""Counters the server keeps while it runs, and a local admin socket that
+   reports them, so one can see which client or stage is saturating the
+   server without stopping it.
+
+   The server thread only adds to plain integer counters: per client in its
+   ClientConnection, and for the whole server in a ServerMetrics. The admin
+   socket is served by its own threads, which read those counters and the
+   ClientRegistry snapshot (safe from any thread), so it still answers,
+   and can show where the server thread is stuck, when the event loop is
+   saturated. Rates are averages since the previous request of the same
+   command, or since the server started for the first one.
+
+   The admin socket listens on ADMIN_HOST only and takes one command per
+   connection; the answer ends when the server closes the connection:
+
+       stats              counters and rates of the whole server (JSON)
+       clients [N]        the N busiest clients by bytes out per second (JSON)
+       stacks             the current stack of every thread
+       profile [SECONDS]  samples every thread's stack for SECONDS and prints
+                          the stacks seen, one line each as "thread;frame;...
+                          count" (the collapsed format flame graph tools read)
+
+   Usage: python admin.py [--port 12346] COMMAND [ARGUMENT]
+   or any line-based tool, e.g. echo stats | nc 127.0.0.1 12346"""
+
+import json
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+ADMIN_HOST = '127.0.0.1' #the admin socket is for this machine only
+ADMIN_PORT = 12346 #workers of the sharded server use the ports after it
+ADMIN_TIMEOUT = 5.0 #seconds an admin connection may take to send its command
+HISTOGRAM_BUCKETS = 24 #bucket i counts durations under 2**i microseconds; the last one everything longer
+TOP_CLIENTS = 20 #clients listed by "clients" without a count
+SAMPLE_INTERVAL = 0.005 #seconds between the stack samples of "profile"
+PROFILE_SECONDS = 1.0 #default length of "profile"
+MAX_PROFILE_SECONDS = 30.0
+
+
+class Histogram:
+    """Counts durations in power-of-two buckets of microseconds; add() is O(1) and allocates nothing."""
+
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def add(self, ns):
+        self.counts[min((ns // 1000).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def percentile(self, p):
+        """The upper bound in microseconds of the bucket holding the p quantile, but
+           no more than the longest duration (which the last bucket has no bound for)."""
+        rank = p * self.count
+        max_us = round(self.max_ns / 1000, 1)
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if bucket_count and seen >= rank:
+                return max_us if i == HISTOGRAM_BUCKETS - 1 else min(2 ** i, max_us)
+        return 0
+
+    def summary(self):
+        counts = list(self.counts) #the server thread may add while this runs
+        return {"count": self.count,
+                "mean_us": round(self.total_ns / self.count / 1000, 1) if self.count else 0,
+                "p50_us": self.percentile(0.50), "p99_us": self.percentile(0.99), "p999_us": self.percentile(0.999),
+                "max_us": round(self.max_ns / 1000, 1),
+                "buckets": {f"<{2 ** i}us" if i < HISTOGRAM_BUCKETS - 1 else f">={2 ** (i - 1)}us": bucket_count
+                            for i, bucket_count in enumerate(counts) if bucket_count}}
+
+
+class ServerMetrics:
+    """Totals of one ChatServerCore; only its server thread changes them."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.accepts = 0
+        self.accept_errors = 0 #accept() failures, e.g. out of file descriptors
+        self.send_errors = 0 #client sockets that failed while being written to
+        self.messages_in = 0 #frames received
+        self.bytes_in = 0
+        self.messages_out = 0 #frames queued for clients
+        self.bytes_out = 0 #bytes written to client sockets, history from the log files included
+        self.fan_out = Histogram() #from a message's fan-out to the end of the writes of its event loop pass
+        self.loop_pass = Histogram() #one pass of the event loop, from the select() return to the end of its writes
+
+
+class AdminServer:
+    """
+    Serves the admin commands for a ChatServerCore on a localhost TCP port.
+    Each admin connection gets a thread of its own, so a long "profile" does
+    not hold up the others; the server thread is never involved.
+    """
+
+    def __init__(self, core, host=ADMIN_HOST, port=ADMIN_PORT):
+        self.core = core
+        self.lock = threading.Lock() #guards previous
+        self.previous = {} #command -> (time, totals) of its last request, for the rates
+        self.server = socketserver.ThreadingTCPServer((host, port), self.make_handler(), bind_and_activate=False)
+        self.server.daemon_threads = True
+        self.server.allow_reuse_address = True
+        try:
+            self.server.server_bind()
+            self.server.server_activate()
+        except OSError:
+            self.server.server_close()
+            raise
+        self.address = self.server.server_address
+        self.thread = None
+
+    def make_handler(self):
+        admin = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            timeout = ADMIN_TIMEOUT
+
+            def handle(self):
+                try:
+                    line = self.rfile.readline().decode("utf-8", "replace")
+                except OSError:
+                    return
+                self.wfile.write(admin.run(line.split()).encode("utf-8"))
+
+        return Handler
+
+    def start(self):
+        """Serves the admin socket on a daemon thread; returns self."""
+        self.thread = threading.Thread(target=self.server.serve_forever, name="ChatAdmin", daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        """Stops serving and closes the admin socket; commands still running finish on their threads."""
+        if self.thread is not None:
+            self.server.shutdown() #waits for serve_forever to return
+            self.thread = None
+        self.server.server_close()
+
+    def run(self, words):
+        """Runs one command and returns its answer as text."""
+        command, arguments = (words[0].lower(), words[1:]) if words else ("help", [])
+        try:
+            if command == "stats":
+                return json.dumps(self.stats(), indent=1) + "\n"
+            if command == "clients":
+                return json.dumps(self.client_stats(int(arguments[0]) if arguments else TOP_CLIENTS), indent=1) + "\n"
+            if command == "stacks":
+                return format_stacks()
+            if command == "profile":
+                seconds = float(arguments[0]) if arguments else PROFILE_SECONDS
+                return sample_stacks(min(max(seconds, SAMPLE_INTERVAL), MAX_PROFILE_SECONDS))
+        except ValueError as e:
+            return f"error: {e}\n"
+        return "commands: stats, clients [N], stacks, profile [SECONDS]\n"
+
+    def rates(self, command, totals):
+        """Per-second rates of the totals since the previous request of command."""
+        now = time.monotonic()
+        with self.lock:
+            then, before = self.previous.get(command, (self.core.metrics.started, {}))
+            self.previous[command] = (now, totals)
+        elapsed = max(now - then, 1e-9)
+        return {name: round((value - before.get(name, 0)) / elapsed, 1) for name, value in totals.items()}
+
+    def stats(self):
+        core = self.core
+        metrics = core.metrics
+        connections = core.clients.snapshot()
+        totals = {"accepts": metrics.accepts, "accept_errors": metrics.accept_errors, "send_errors": metrics.send_errors,
+                  "messages_in": metrics.messages_in, "bytes_in": metrics.bytes_in,
+                  "messages_out": metrics.messages_out, "bytes_out": metrics.bytes_out}
+        rates = self.rates("stats", totals)
+        return {"uptime_s": round(time.monotonic() - metrics.started, 1),
+                "connections": len(connections),
+                "detached_sessions": len(core.detached),
+                "rooms": len(core.rooms),
+                **totals,
+                **{f"{name}_per_s": rate for name, rate in rates.items()},
+                "dropped": sum(connection.dropped for connection in connections),
+                "outbound_frames": sum(len(connection.outbound) for connection in connections),
+                "outbound_bytes": sum(connection.outbound_bytes for connection in connections),
+                "fan_out": metrics.fan_out.summary(),
+                "loop_pass": metrics.loop_pass.summary()}
+
+    def client_stats(self, limit):
+        """The counters and rates of every connected client, busiest first."""
+        now = time.monotonic()
+        connections = self.core.clients.snapshot()
+        with self.lock:
+            then, before = self.previous.get("clients", (None, {}))
+            self.previous["clients"] = (now, {connection: (connection.messages_in, connection.bytes_in,
+                                                           connection.messages_out, connection.bytes_out)
+                                              for connection in connections})
+        clients = []
+        for connection in connections:
+            totals = (connection.messages_in, connection.bytes_in, connection.messages_out, connection.bytes_out)
+            if connection in before:
+                elapsed, start = now - then, before[connection]
+            else: #new since the previous request
+                elapsed, start = now - connection.connected_at, (0, 0, 0, 0)
+            elapsed = max(elapsed, 1e-9)
+            messages_in, bytes_in, messages_out, bytes_out = ((total - first) / elapsed
+                                                              for total, first in zip(totals, start))
+            clients.append({"id": connection.client_id,
+                            "connected_s": round(now - connection.connected_at, 1),
+                            "messages_in_per_s": round(messages_in, 1), "bytes_in_per_s": round(bytes_in, 1),
+                            "messages_out_per_s": round(messages_out, 1), "bytes_out_per_s": round(bytes_out, 1),
+                            "messages_in": totals[0], "bytes_in": totals[1],
+                            "messages_out": totals[2], "bytes_out": totals[3],
+                            "outbound_frames": len(connection.outbound), "outbound_bytes": connection.outbound_bytes,
+                            "dropped": connection.dropped, "rooms": len(connection.rooms),
+                            "caps": sorted(connection.caps), "ring_reader": connection.ring_reader})
+        clients.sort(key=lambda client: client["bytes_out_per_s"], reverse=True)
+        return {"connections": len(connections), "clients": clients[:max(0, limit)]}
+
+
+def thread_names():
+    return {thread.ident: thread.name for thread in threading.enumerate()}
+
+
+def format_stacks():
+    """The current stack of every thread of this process, innermost call last."""
+    names = thread_names()
+    lines = []
+    for ident, frame in sys._current_frames().items():
+        lines.append(f'Thread "{names.get(ident, "?")}" ({ident}):')
+        lines.extend(line.rstrip("\n") for line in traceback.format_stack(frame))
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def sample_stacks(seconds):
+    """Takes a stack sample of every other thread each SAMPLE_INTERVAL for seconds and
+       returns how often each stack was seen, most frequent first."""
+    me = threading.get_ident()
+    seen = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = thread_names()
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            calls = []
+            while frame is not None:
+                calls.append(f"{frame.f_code.co_name} ({frame.f_code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            seen[";".join([names.get(ident, str(ident))] + calls[::-1])] += 1
+        samples += 1
+        time.sleep(SAMPLE_INTERVAL)
+    lines = [f"#{samples} samples over {seconds:.2f}s"]
+    lines.extend(f"{stack} {times}" for stack, times in seen.most_common())
+    return "\n".join(lines) + "\n"
+
+
+def query(command, host=ADMIN_HOST, port=ADMIN_PORT):
+    """Sends one command to an admin socket and returns the answer."""
+    with socket.create_connection((host, port), timeout=MAX_PROFILE_SECONDS + ADMIN_TIMEOUT) as admin_socket:
+        admin_socket.sendall(command.encode("utf-8") + b"\n")
+        chunks = []
+        while True:
+            chunk = admin_socket.recv(65536)
+            if not chunk:
+                return b"".join(chunks).decode("utf-8", "replace")
+            chunks.append(chunk)
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    port = ADMIN_PORT
+    if "--port" in arguments:
+        i = arguments.index("--port")
+        port = int(arguments[i + 1])
+        del arguments[i:i + 2]
+    sys.stdout.write(query(" ".join(arguments) or "help", port=port))
@@ -4,12 +4,540 @@
 #Content of client.py; to complete/implement
 
 from tkinter import *
+from array import array
+from collections import deque
 import socket
+import struct
+import random
+import tempfile
 import threading
+import time
+
+import protocol
+import shm_ring
+
+HOST = '127.0.0.1'
+PORT = 12345
+
+HISTORY_LINES = 500 #chat history messages kept in the Text widget while it follows the newest ones
+HISTORY_PAGE = 100 #older messages loaded back from the spill file each time the view reaches the top
+HISTORY_ON_CONNECT = 50 #messages from before this client joined that are asked from the server's log
+CLIENT_CAPS = (protocol.CAP_BATCH, protocol.CAP_ZLIB, protocol.CAP_RESUME) #capabilities offered to the server in HELLO
+HAVE_CORK = hasattr(socket, "TCP_CORK") #Linux
+CORK_BYTES = 16 * 1024 #writes this large are corked, so sendall's pieces leave as full segments
+RECONNECT_MIN_SECONDS = 0.5 #first wait before reconnecting; it doubles after every failed attempt
+RECONNECT_MAX_SECONDS = 30.0
+CLOSE_SECONDS = 1.0 #how long close() waits for the writer to send what is queued
+
+
+class HistorySpill:
+    """Compact local file holding every chat history line, so the Text widget only
+       needs a window of them. Each record is a 1 byte alignment, a 4 byte length and
+       the UTF-8 text; offsets keeps where every record starts, and widget_lines how
+       many lines of the Text widget it takes (a message may contain newlines)."""
+
+    RECORD = struct.Struct("!BI")
+    ALIGNS = ("left", "right", "center")
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile() #deleted by the OS when the client exits
+        self.offsets = array("Q")
+        self.widget_lines = array("I")
+        self.end = 0
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, message, align):
+        """Adds one line at the end of the file."""
+        data = message.encode("utf-8")
+        self.file.seek(self.end)
+        self.file.write(self.RECORD.pack(self.ALIGNS.index(align), len(data)) + data)
+        self.offsets.append(self.end)
+        self.widget_lines.append(message.count("\n") + 1)
+        self.end += self.RECORD.size + len(data)
+
+    def read(self, start, stop):
+        """Returns lines start..stop-1 as (message, align) pairs with one read."""
+        first = self.offsets[start]
+        last = self.offsets[stop] if stop < len(self.offsets) else self.end
+        self.file.seek(first)
+        data = self.file.read(last - first)
+        lines = []
+        offset = 0
+        while offset < len(data):
+            align, length = self.RECORD.unpack_from(data, offset)
+            offset += self.RECORD.size
+            lines.append((data[offset:offset + length].decode("utf-8"), self.ALIGNS[align]))
+            offset += length
+        return lines
+
+    def count_widget_lines(self, start, stop):
+        """Returns how many lines of the Text widget lines start..stop-1 take."""
+        return sum(self.widget_lines[start:stop])
+
+
+class ChatConnection:
+    """
+    The networking of a chat client, without any GUI.
+    connect() opens the connection, offers `caps` to the server, receives the
+    client id and asks for the last `history` logged messages; start() then
+    receives on one daemon thread and writes on another. send() only queues
+    the message for the writer, so a GUI calling it never waits for the
+    network; the writer sends everything queued since its last write in one
+    sendall, packed into one frame if the server accepts batches.
+    Programs with their own event loop can skip start() and pass whatever
+    they read from self.socket to handle_data() instead.
+    Callbacks, all optional: on_connect(client_id), on_message(line) with the
+    chat history line of every message, join and leave, on_disconnect(), and
+    on_room_join(room) when the server confirms the client is in a room.
+    After start() they are called on the receiving thread.
+    With unix_path the connection is made to the server's Unix domain socket
+    instead of host and port. With ring_name the client also offers "ring":
+    if the server takes it, broadcasts are read from the server's shared-memory
+    ring on a third thread, and on_message may be called from that one too.
+    Broadcasts the ring overwrote before they were read are asked for again
+    from the server's log.
+    After start(), a lost connection is reconnected with jittered exponential
+    backoff (on_disconnect, then on_connect again). The client resumes its
+    session, keeping its id if the server still has it, and is sent every
+    message after the last one it received; messages sent meanwhile wait in
+    the queue. close() ends the connection for good.
+    The client starts in the lobby room, whose messages are the plain chat
+    broadcasts. join_room() and leave_room() change its rooms, which the
+    server confirms; send_to_room() and send_direct() address one room or
+    one client. A new session rejoins the rooms of the previous one.
+    """
+
+    def __init__(self, host=HOST, port=PORT, on_connect=None, on_message=None, on_disconnect=None,
+                 history=HISTORY_ON_CONNECT, caps=CLIENT_CAPS, unix_path=None, ring_name=None, on_room_join=None):
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.ring_name = ring_name
+        self.on_connect = on_connect
+        self.on_message = on_message
+        self.on_disconnect = on_disconnect
+        self.on_room_join = on_room_join
+        self.history = history
+        self.offered_caps = frozenset(caps) | ({protocol.CAP_RING} if ring_name is not None else frozenset())
+        self.caps = frozenset() #what the server agreed to; packed frames are unpacked by the decoder
+
+        self.socket = None
+        self.connected = False
+        self.client_id = None #initialize client id variable to be received by server
+        self.number = 0 #the N of "Client N"; the ring's records of this client's own messages are skipped
+        self.own_prefixes = () #"Client N: " of every id this client had, as bytes
+        self.session = None #token from the server's SESSION frame, sent back in RESUME
+        self.client_port = None
+        self.decoder = protocol.FrameDecoder() #reassembles frames from the server
+        self.last_seq = None #sequence number of the newest logged message received
+        self.replays = 0 #history replays asked for and not finished yet
+        self.replay_seen = None #records shown while replays run; None when none does
+        self.delivery_lock = threading.Lock() #the receiving and ring threads both deliver records
+        self.ring = None #shm_ring.RingReader once the server has sent RING_START
+        self.held = [] #frames read from the ring while a replay runs; delivered after it
+        self.resyncing = False #a replay asked for to catch up runs; it has this client's own messages too
+        self.rooms = {protocol.LOBBY} #rooms the server confirmed this client is in
+
+        self.outbound = deque() #encoded frames waiting for the writer thread
+        self.outbound_ready = threading.Condition()
+        self.closing = False
+        self.writer = None #the writer thread of the current connection
+        self.generation = 0 #counts the connections; the writer threads of older ones stop
+
+    def connect(self):
+        """Connects to the server; raises OSError if it cannot be reached. After a lost
+           connection it is called again to reconnect: then the client sends RESUME with its
+           session token, in the same write as HELLO, and asks for every record after the
+           last one it received, so nothing is missed or shown twice."""
+        self.open_socket()
+        with self.delivery_lock:
+            reconnecting = self.client_id is not None
+            if reconnecting:
+                request = self.catch_up()
+            else:
+                request = (protocol.HISTORY_LAST, self.history) if self.history else None
+            self.replays = 1 if request else 0
+            self.replay_seen = set() if request else None
+            self.held = []
+            self.resyncing = reconnecting
+        greeting = protocol.encode_caps(protocol.HELLO, self.offered_caps) if self.offered_caps else b""
+        resuming = reconnecting and self.session is not None
+        if resuming: #the server replays the records itself
+            greeting += protocol.encode_resume(self.session, *request)
+        if greeting:
+            self.socket.sendall(greeting)
+        previous_id = self.client_id
+        client_id, frames = self.receive_client_id(resuming)  # Receive the client ID from the server
+        self.set_client_id(client_id)
+        setup = b""
+        if request and not resuming:
+            setup += protocol.encode_history_request(*request) #asks for recent or missed messages
+        if reconnecting and client_id != previous_id: #a new session; the server does not know its rooms
+            setup += b"".join(protocol.encode_frame(protocol.ROOM_JOIN, room) for room in sorted(self.rooms - {protocol.LOBBY}))
+            if protocol.LOBBY not in self.rooms:
+                setup += protocol.encode_frame(protocol.ROOM_LEAVE, protocol.LOBBY)
+        if setup:
+            self.socket.sendall(setup)
+        self.connected = True
+        if self.on_connect is not None:
+            self.on_connect(self.client_id)
+        self.handle_frames(frames)
+
+    def open_socket(self):
+        """Opens a new socket to the server, with fresh per-connection state."""
+        self.decoder = protocol.FrameDecoder()
+        self.caps = frozenset()
+        if self.unix_path is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                self.socket.connect(self.unix_path)
+            except OSError:
+                self.socket.close()
+                raise
+        else:
+            self.socket = socket.create_connection((self.host, self.port))
+            #every write is a whole batch of messages, so waiting for more data (Nagle) only adds latency
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.client_port = self.socket.getsockname()[1]  # Get client's port number
+
+    def receive_client_id(self, resuming=False):
+        """Reads frames until the server's id frame arrives, and when resuming until the
+           server's answer to RESUME; returns the id and the other frames after the id."""
+        client_id = None
+        frames = []
+        while client_id is None or resuming:
+            data = self.socket.recv(protocol.RECV_SIZE)
+            if not data:
+                raise ConnectionResetError("server closed the connection")
+            for frame_type, payload in self.decoder.feed(data):
+                if client_id is None:
+                    if frame_type == protocol.ASSIGN_ID:
+                        client_id = payload.decode("utf-8")
+                elif resuming and frame_type == protocol.RESUME:
+                    resuming = False
+                    if payload: #the session was resumed; otherwise the new id stands
+                        client_id = payload.decode("utf-8")
+                else:
+                    frames.append((frame_type, payload))
+        return client_id, frames
+
+    def set_client_id(self, client_id):
+        self.client_id = client_id
+        number = client_id.rpartition(" ")[2]
+        self.number = int(number) if number.isdigit() else 0
+        prefix = f"{client_id}: ".encode("utf-8")
+        if prefix not in self.own_prefixes:
+            self.own_prefixes += (prefix,)
+
+    def start(self):
+        """Starts the receiving thread, which starts a writer thread for every connection.
+           If connect() failed, it keeps trying to connect first."""
+        threading.Thread(target=self.receive_forever, daemon=True).start() # Start thread handle messages coming in from the server 
+
+    def send(self, message):
+        """Queues a chat message for the writer thread and returns at once; raises OSError
+           if the client never connected or is closed."""
+        if self.client_id is None or self.closing:
+            raise ConnectionError("not connected")
+        self.queue_frame(protocol.encode_frame(protocol.CHAT, message))
+
+    def send_to_room(self, room, message):
+        """Queues a message to one of this client's rooms; raises ValueError for an invalid name."""
+        if room == protocol.LOBBY:
+            self.send(message)
+            return
+        frame = protocol.encode_addressed(protocol.ROOM_CHAT, room, message)
+        if self.client_id is None or self.closing:
+            raise ConnectionError("not connected")
+        self.queue_frame(frame)
+
+    def send_direct(self, client_id, message):
+        """Queues a message to the client with id client_id ("Client N") only."""
+        frame = protocol.encode_addressed(protocol.DIRECT, client_id, message)
+        if self.client_id is None or self.closing:
+            raise ConnectionError("not connected")
+        self.queue_frame(frame)
+
+    def join_room(self, room):
+        """Asks to join a room; on_room_join and on_message are called once the server
+           confirms it, and on_message with the reason if the server refuses."""
+        if not room or len(room.encode("utf-8")) > protocol.MAX_NAME_BYTES:
+            raise ValueError(f"room names must be 1 to {protocol.MAX_NAME_BYTES} bytes")
+        if self.client_id is None or self.closing:
+            raise ConnectionError("not connected")
+        self.queue_frame(protocol.encode_frame(protocol.ROOM_JOIN, room))
+
+    def leave_room(self, room):
+        """Asks to leave a room; on_message gets a line once the server confirms it."""
+        if self.client_id is None or self.closing:
+            raise ConnectionError("not connected")
+        self.queue_frame(protocol.encode_frame(protocol.ROOM_LEAVE, room))
+
+    def queue_frame(self, frame):
+        with self.outbound_ready:
+            self.outbound.append(frame)
+            self.outbound_ready.notify_all()
+
+    def close(self):
+        """Ends the connection for good. The server is told, so it does not keep this
+           client's session for it to come back to."""
+        with self.outbound_ready:
+            if self.connected:
+                self.outbound.append(protocol.encode_frame(protocol.LEAVE))
+            self.closing = True
+            self.outbound_ready.notify_all()
+        writer = self.writer
+        if writer is not None and writer is not threading.current_thread():
+            writer.join(CLOSE_SECONDS) #lets it write what is queued
+        if self.socket is not None:
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR) #wakes the receiving thread; close alone may not
+            except OSError:
+                pass
+            self.socket.close()
+
+    def start_writer(self):
+        """Starts the writer of the connection connect() just made. Until then frames stay
+           queued, so none is written before the HELLO and RESUME of a reconnection."""
+        with self.outbound_ready:
+            self.writer = threading.Thread(target=self.write_forever, args=(self.generation, self.socket), daemon=True)
+        self.writer.start()
+
+    def write_forever(self, generation, client_socket):
+        """Writer thread of one connection: waits for queued frames and writes all of them
+           at once. It only ever writes to its own connection's socket, and stops once that
+           connection is lost. Frames it could not write are put back for the next
+           connection's writer, so a message is sent twice rather than lost if the connection
+           broke mid-write."""
+        packer = None #protocol.FramePacker once the server has agreed to batches
+        while True:
+            with self.outbound_ready:
+                while not self.outbound and not self.closing and self.generation == generation:
+                    self.outbound_ready.wait()
+                if self.generation != generation or not self.outbound:
+                    return
+                frames = list(self.outbound)
+                self.outbound.clear()
+            if packer is None and protocol.CAP_BATCH in self.caps:
+                packer = protocol.FramePacker(protocol.CAP_ZLIB in self.caps)
+            try:
+                self.write_batch(frames, client_socket, packer)
+            except OSError:
+                with self.outbound_ready:
+                    self.outbound.extendleft(reversed(frames))
+                return #the receiving thread sees the connection end too
+
+    def write_batch(self, frames, client_socket, packer=None):
+        """Writes frames with one sendall, as one packed frame if packer is given and it is worth it."""
+        size = sum(len(frame) for frame in frames)
+        if packer is not None and packer.worth_packing(len(frames), size):
+            data = packer.pack(frames)
+        else:
+            data = b"".join(frames)
+        cork = HAVE_CORK and self.unix_path is None and len(data) >= CORK_BYTES
+        if cork:
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+        try:
+            client_socket.sendall(data) #sendall, unlike send, never leaves part of the data unsent
+        finally:
+            if cork:
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+
+    def receive_forever(self):
+        """Receiving thread: handles the server's frames until the connection ends, then
+           reconnects, until close() is called."""
+        while not self.closing:
+            if not self.connected and not self.reconnect():
+                break
+            self.start_writer()
+            self.receive_until_closed()
+            self.connection_lost()
+            if self.on_disconnect is not None:
+                self.on_disconnect()
+
+    def receive_until_closed(self):
+        """Listens for incoming messages from the server until the connection ends"""
+        while True:
+            try:
+                data = self.socket.recv(protocol.RECV_SIZE) #receives frames from server
+            #Handles error by exiting loop if server disconnects or another connection error occurs 
+            except OSError:
+                break
+            if not data or not self.handle_data(data):
+                break #server closed the connection
+
+    def connection_lost(self):
+        self.connected = False
+        with self.outbound_ready:
+            self.generation += 1
+            self.outbound_ready.notify_all() #this connection's writer stops; frames wait for the next one
+        with self.delivery_lock:
+            self.ring = None #stops the ring thread
+        self.socket.close()
+
+    def reconnect(self):
+        """Connects again, waiting between attempts for a random time between half and all
+           of a delay that doubles from RECONNECT_MIN_SECONDS to RECONNECT_MAX_SECONDS, so
+           clients that lost the same server do not all come back at once. Returns False
+           if close() was called first."""
+        delay = RECONNECT_MIN_SECONDS
+        while True:
+            with self.outbound_ready:
+                if self.outbound_ready.wait_for(lambda: self.closing, random.uniform(delay / 2, delay)):
+                    return False
+            try:
+                self.connect()
+                return True
+            except (OSError, protocol.ProtocolError):
+                if self.socket is not None:
+                    self.socket.close()
+                delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+
+    def handle_data(self, data):
+        """Handles bytes received from the server; returns False if they are not valid frames."""
+        try:
+            self.handle_frames(self.decoder.feed(data))
+        except protocol.ProtocolError:
+            return False
+        return True
+
+    def handle_frames(self, frames):
+        with self.delivery_lock:
+            for frame_type, payload in frames:
+                self.handle_frame(frame_type, payload)
+
+    def handle_frame(self, frame_type, payload):
+        """Passes a frame from the server to on_message. Logged messages come as RECORD
+           frames; while a replay of the log runs, a message can arrive both live and
+           replayed, so each record is passed on only once. Called with delivery_lock held."""
+        if frame_type == protocol.HISTORY_END:
+            end, = protocol.RECORD_SEQ.unpack(payload) #every record before it was covered by the replay
+            if self.last_seq is None or end - 1 > self.last_seq:
+                self.last_seq = end - 1
+            self.replays -= 1
+            if self.replays <= 0:
+                self.replays = 0
+                self.replay_seen = None
+                self.resyncing = False
+                held, self.held = self.held, []
+                for frame_type, payload in held:
+                    self.handle_frame(frame_type, payload)
+            return
+        if frame_type == protocol.CAPS:
+            self.caps = protocol.decode_caps(payload)
+            return
+        if frame_type == protocol.RING_START:
+            self.open_ring(protocol.RECORD_SEQ.unpack(payload)[0])
+            return
+        if frame_type == protocol.SESSION:
+            self.session = payload
+            return
+        if frame_type == protocol.ROOM_JOIN:
+            self.rooms.add(payload.decode("utf-8", "replace"))
+            if self.on_room_join is not None:
+                self.on_room_join(payload.decode("utf-8", "replace"))
+        elif frame_type == protocol.ROOM_LEAVE:
+            self.rooms.discard(payload.decode("utf-8", "replace"))
+        if frame_type == protocol.RECORD:
+            seq, frame_type, payload = protocol.decode_record(payload)
+            if self.replay_seen is not None:
+                if seq in self.replay_seen:
+                    return
+                self.replay_seen.add(seq)
+            elif self.last_seq is not None and seq <= self.last_seq:
+                return #already shown; live records arrive in order
+            if self.last_seq is None or seq > self.last_seq:
+                self.last_seq = seq
+            if self.resyncing and frame_type == protocol.CHAT and payload.startswith(self.own_prefixes):
+                return #sent by this client, so never shown as received
+        server_message = self.format_frame(frame_type, payload)
+        if server_message and self.on_message is not None:
+            self.on_message(server_message)
+
+    def open_ring(self, position):
+        """Starts reading broadcasts from the server's ring at the write position it sent."""
+        try:
+            self.ring = shm_ring.RingReader(self.ring_name, position)
+        except OSError:
+            return #not on the server's machine after all; nothing can be done about the broadcasts
+        threading.Thread(target=self.read_ring_forever, args=(self.ring,), daemon=True).start()
+
+    def read_ring_forever(self, ring):
+        """Ring thread: delivers the broadcasts of the other clients from the ring, polling
+           less often while it is idle. While a replay runs they are held back until it ends,
+           so they are not shown before older replayed messages."""
+        delay = shm_ring.POLL_MIN
+        while not self.closing and self.ring is ring: #a lost connection's ring reader stops
+            records, missed = ring.read()
+            if missed:
+                self.resync()
+            if not records:
+                if not missed:
+                    time.sleep(delay)
+                    delay = min(delay * 2, shm_ring.POLL_MAX)
+                continue
+            delay = shm_ring.POLL_MIN
+            with self.delivery_lock:
+                if self.ring is not ring:
+                    break
+                for sender_number, frame in records:
+                    if sender_number == self.number or protocol.LOBBY not in self.rooms:
+                        continue
+                    frame_type = frame[0]
+                    payload = frame[protocol.HEADER.size:]
+                    if self.replay_seen is not None:
+                        self.held.append((frame_type, payload))
+                    else:
+                        self.handle_frame(frame_type, payload)
+        ring.close()
+
+    def resync(self):
+        """Asks the server's log for everything after the last record shown, which covers
+           the broadcasts the ring overwrote before this client read them."""
+        with self.delivery_lock:
+            request = protocol.encode_history_request(*self.catch_up())
+            self.replays += 1
+            self.resyncing = True
+            if self.replay_seen is None:
+                self.replay_seen = set()
+        self.queue_frame(request)
+
+    def catch_up(self):
+        """Returns the (mode, value) of a history request for every record after the last
+           one received. Called with delivery_lock held."""
+        if self.last_seq is None: #no replay has ended yet, so where the log was is unknown
+            return protocol.HISTORY_LAST, self.history or HISTORY_ON_CONNECT
+        if self.last_seq < 0: #the log was empty
+            return protocol.HISTORY_LAST, 2 ** 64 - 1
+        return protocol.HISTORY_AFTER, self.last_seq
+
+    def format_frame(self, frame_type, payload):
+        """Returns the chat history line for a frame from the server, or None if it has none."""
+        text = payload.decode("utf-8", "replace")
+        if frame_type == protocol.CHAT:
+            return text
+        if frame_type == protocol.LEAVE:
+            return f"{text} has left the chat."
+        if frame_type == protocol.ROOM_JOIN:
+            return f"You are in room {text}."
+        if frame_type == protocol.ROOM_LEAVE:
+            return f"You left room {text}."
+        if frame_type == protocol.ERROR:
+            return text
+        if frame_type in (protocol.ROOM_CHAT, protocol.DIRECT):
+            try:
+                name, message = protocol.decode_addressed(payload)
+            except protocol.ProtocolError:
+                return None
+            return f"[{name}] {message}" if frame_type == protocol.ROOM_CHAT else f"[from {name}] {message}"
+        return None
+
 
 class ChatClient:
 
-    def __init__(self, window: Tk):
+    def __init__(self, window: Tk, host=HOST, port=PORT, unix_path=None, ring_name=None):
         """It initialzes the client GUI recreating client chat history between clients
            and providing entry point for message to be sent. 
            It also starts server connection."""
@@ -17,19 +545,35 @@ class ChatClient:
         self.window = window
         self.window.title("Client Chat")
 
-        self.clientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # Create a socket
-
-        self.client_id = None #initialize client id variable to be received by server
+        self.history = HistorySpill() #every chat history message; the widget shows messages first_shown.. of it
+        self.first_shown = 0
+        self.loading_older = False
+        self.incoming = deque() #lines from the receive thread waiting for the next batched insert
+        self.flush_scheduled = False
+        self.client_id = None
+        self.announce_connect = False #shows "Connected as" for every connection but a first one that worked at once
+        self.current_room = protocol.LOBBY #where typed messages go; changed by /join and /leave
+        self.joining = None #room of the last /join, which becomes the current room once the server confirms it
 
+        self.connection = ChatConnection(host, port, on_connect=self.on_connect,
+                                         on_message=lambda line: self.queue_incoming(line, "left"),
+                                         on_disconnect=lambda: self.queue_incoming("Disconnected from the server; reconnecting.", "center"),
+                                         unix_path=unix_path, ring_name=ring_name, on_room_join=self.on_room_join)
         try:
-            self.clientSocket.connect(('127.0.0.1', 12345)) #connects at host on port 12345
-            self.client_id = self.clientSocket.recv(1024).decode()  # Receive the client ID from the server
-            self.client_port = self.clientSocket.getsockname()[1]  # Get client's port number
-        #Handles any connection errors
-        except socket.error as e:
+            self.connection.connect() #connects at host on port
+        #Handles any connection errors; the connection keeps trying in the background
+        except (OSError, protocol.ProtocolError) as e:
             print(f"Connection failed: {e}") 
+            self.queue_incoming("Could not connect to the server; retrying.", "center")
+            self.announce_connect = True
 
-        Label(self.window, text=f"Client @ port#{self.client_port}").grid(row=0, column=0) # creates label for client port number
+        address = unix_path if unix_path is not None else f"{host}:{port}"
+        if self.client_id is not None and self.connection.client_port is not None:
+            Label(self.window, text=f"Client @ port#{self.connection.client_port}").grid(row=0, column=0) # creates label for client port number
+        elif self.client_id is not None:
+            Label(self.window, text=f"Client @ {address}").grid(row=0, column=0)
+        else:
+            Label(self.window, text=f"Client (no server at {address})").grid(row=0, column=0)
 
         # creates chat message label and entry
         Label(self.window, text="Chat message").grid(row=1, column=0)
@@ -49,43 +593,153 @@ class ChatClient:
         #creates a scrollbar for chat history
         scrollbar = Scrollbar(self.chat_frame, command=self.chat_history.yview)
         scrollbar.pack(side="right", fill="y")
-        self.chat_history.config(yscrollcommand=scrollbar.set)
+        self.scrollbar = scrollbar
+        self.chat_history.config(yscrollcommand=self.on_history_scroll)
 
         self.chat_frame.grid(row=3, column=0, columnspan=3, padx=5, pady=5)
 
         self.client_entry.bind("<Return>", self.send_message)# binds enter key to when message is sent 
+        self.window.protocol("WM_DELETE_WINDOW", self.on_close) #closing the window leaves the chat
+
+        self.connection.start()
 
-        threading.Thread(target=self.receive_message, daemon=True).start() # Start thread handle messages coming in from the server 
+    def on_close(self):
+        """Leaves the chat for good, so the server does not hold the session for a resume, then closes the window."""
+        self.connection.close()
+        self.window.destroy()
+
+    def on_connect(self, client_id):
+        """Called when the connection is made, and again after every reconnection."""
+        if self.announce_connect:
+            self.queue_incoming(f"Connected as {client_id}.", "center")
+        self.announce_connect = True
+        self.client_id = client_id
+
+    def on_room_join(self, room):
+        """Called when the server confirms a room; the one of the last /join becomes the current room."""
+        if room == self.joining:
+            self.joining = None
+            self.current_room = room
 
     def send_message(self, event=None):
-        """ It sends messages to the server and also displayed in the client's chat history if valid."""
+        """ It sends messages to the server and also displayed in the client's chat history if valid.
+            Messages go to the current room; lines starting with / are commands (see run_command)."""
         new_message = self.client_entry.get()
         if new_message.strip():
-            self.clientSocket.send(new_message.encode()) #sends message to server
-            self.update_chat_history(f"{self.client_id}: {new_message}", align="center") #displays the sent message 
+            try:
+                if new_message.startswith("/"):
+                    sent_line = self.run_command(new_message)
+                elif self.current_room == protocol.LOBBY:
+                    self.connection.send(new_message)
+                    sent_line = f"{self.client_id}: {new_message}"
+                else:
+                    self.connection.send_to_room(self.current_room, new_message)
+                    sent_line = f"[{self.current_room}] {self.client_id}: {new_message}"
+            except OSError:
+                self.update_chat_history("Not connected to the server.", align="center")
+                return
+            except ValueError as e: #an unknown command or invalid name
+                self.update_chat_history(str(e), align="center")
+                return
+            if sent_line:
+                self.update_chat_history(sent_line, align="center") #displays the sent message 
             self.client_entry.delete(0, END) #clears box for entries 
 
-    def receive_message(self):
-        """Listens for incoming messages from the server and updates chat history if new message is received """
-        while True:
-            try:
-                server_message = self.clientSocket.recv(1024).decode() #receives message from server
-                if server_message:
-                    self.window.after(0, self.update_chat_history, f"{server_message}", "left") #updates chat 
-            #Handles error by exiting loop if server disconnects or another connection error occurs 
-            except (ConnectionResetError, BrokenPipeError): 
-                break
+    def run_command(self, line):
+        """Runs /join ROOM (which also makes it the current room once the server confirms
+           it), /leave [ROOM] or /dm N MESSAGE, and returns the line to show for it, if any."""
+        command, _, argument = line.partition(" ")
+        argument = argument.strip()
+        if command == "/join" and argument:
+            self.connection.join_room(argument)
+            self.joining = argument
+            return None #the server's confirmation, or why it refused, is shown
+        if command == "/leave":
+            room = argument or self.current_room
+            self.connection.leave_room(room)
+            if room == self.joining:
+                self.joining = None
+            if room == self.current_room:
+                self.current_room = protocol.LOBBY
+            return None
+        if command == "/dm":
+            if argument.startswith("Client "):
+                argument = argument[len("Client "):]
+            number, _, message = argument.partition(" ")
+            if number.isdigit() and message.strip():
+                self.connection.send_direct(f"Client {number}", message)
+                return f"[to Client {number}] {message}"
+        raise ValueError("Commands: /join ROOM, /leave [ROOM], /dm N MESSAGE")
+
+    def queue_incoming(self, message, align):
+        """Called on the receive thread; lines are handed to the Tk main loop in batches,
+           with at most one flush_incoming scheduled at a time."""
+        self.incoming.append((message, align))
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.window.after(0, self.flush_incoming)
+
+    def flush_incoming(self):
+        """Inserts every line queued since the last flush."""
+        self.flush_scheduled = False #cleared before draining so a line queued meanwhile schedules a new flush
+        lines = []
+        while self.incoming:
+            lines.append(self.incoming.popleft())
+        if lines:
+            self.add_history_lines(lines)
 
     def update_chat_history(self, message, align="left"):
         """updates chat history display with a new message"""
+        self.add_history_lines([(message, align)])
+
+    def add_history_lines(self, lines):
+        """Spills the lines to the history file and appends them to the widget with one insert.
+           While the view follows the newest messages, lines above the last HISTORY_LINES are
+           dropped from the widget; they can be loaded back by scrolling to the top."""
+        following = self.chat_history.yview()[1] >= 1.0
+        segments = []
+        for message, align in lines:
+            self.history.append(message, align)
+            segments += [f"{message}\n", align]
+        self.chat_history.config(state="normal")
+        self.chat_history.insert(END, *segments)
+        if following:
+            excess = len(self.history) - self.first_shown - HISTORY_LINES
+            if excess > 0:
+                widget_lines = self.history.count_widget_lines(self.first_shown, self.first_shown + excess)
+                self.chat_history.delete("1.0", f"{widget_lines + 1}.0")
+                self.first_shown += excess
+        self.chat_history.config(state="disabled")
+        if following:
+            self.chat_history.see(END)
+
+    def on_history_scroll(self, first, last):
+        """yscrollcommand of the chat history; loads older lines once the top is reached."""
+        self.scrollbar.set(first, last)
+        if float(first) <= 0.0 and self.first_shown > 0 and not self.loading_older:
+            self.loading_older = True
+            self.window.after_idle(self.load_older_lines)
+
+    def load_older_lines(self):
+        """Prepends the HISTORY_PAGE lines before the oldest shown one, keeping the view on
+           the line that was at the top."""
+        self.loading_older = False
+        start = max(0, self.first_shown - HISTORY_PAGE)
+        lines = self.history.read(start, self.first_shown)
+        if not lines:
+            return
+        segments = []
+        for message, align in lines:
+            segments += [f"{message}\n", align]
         self.chat_history.config(state="normal")
-        self.chat_history.insert(END, f"{message}\n", align) #add the new message
+        self.chat_history.insert("1.0", *segments)
         self.chat_history.config(state="disabled")
-        self.chat_history.see(END)
+        self.chat_history.yview(f"{self.history.count_widget_lines(start, self.first_shown) + 1}.0")
+        self.first_shown = start
 
-def main():
+def main(host=HOST, port=PORT, unix_path=None, ring_name=None):
     window = Tk()
-    ChatClient(window)
+    ChatClient(window, host, port, unix_path, ring_name)
     window.mainloop()
 
 if __name__ == '__main__':
@@ -0,0 +1,224 @@
+#Content of loadgen.py; load test for the chat server
+
+"""Simulates many chat clients against a running server and reports throughput
+   and end-to-end latency.
+
+   The clients are spread over several processes; each process connects its
+   share with client.ChatConnection and then drives all of them from one
+   selectors loop, so thousands of clients need no threads. The first
+   --senders clients send --rate messages per second each, of --size bytes;
+   every client counts what it receives. A message carries the
+   time.monotonic_ns() of its sending, which is the same clock in every
+   process on the machine, so each receiver knows the message's latency.
+
+   Usage: python loadgen.py [--clients 1000] [--processes 4] [--senders 10]
+          [--rate 10] [--size 100] [--duration 10] [--caps batch,zlib]
+          [--host 127.0.0.1] [--port 12345] [--unix PATH]
+"""
+
+import argparse
+import multiprocessing
+import random
+import selectors
+import time
+from array import array
+
+import protocol
+from client import HOST, PORT, ChatConnection
+from server import raise_open_file_limit
+
+MARKER = "loadgen" #starts every load message, followed by the send time in ns
+MAX_SAMPLES = 200000 #latencies kept per process; later ones replace random earlier ones
+DRAIN_SECONDS = 1.0 #time left after the sending stops for messages still on the way
+
+
+class SimulatedClient:
+    """One load client: a connection, its unsent bytes and its send schedule."""
+
+    def __init__(self, connection, stats):
+        self.connection = connection
+        self.outbound = bytearray()
+        self.next_send = 0.0
+        connection.on_message = stats.record
+
+    def fileno(self):
+        return self.connection.socket.fileno()
+
+
+class Stats:
+    """What one process measured."""
+
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+        self.sent = 0
+        self.received = 0
+        self.received_bytes = 0
+        self.wire_bytes = 0 #bytes read from the sockets, compressed or not
+        self.latencies = array("q") #ns
+        self.rng = random.Random()
+
+    def record(self, line):
+        """on_message of every client: counts load messages and samples their latency."""
+        now = time.monotonic_ns()
+        marker = line.find(MARKER)
+        if marker < 0:
+            return #joins, leaves and messages of other clients
+        start = marker + len(MARKER)
+        sent_at = int(line[start:line.find(" ", start)])
+        self.received += 1
+        self.received_bytes += len(line)
+        if len(self.latencies) < MAX_SAMPLES:
+            self.latencies.append(now - sent_at)
+        else: #reservoir sampling keeps the sample uniform over the whole run
+            i = self.rng.randrange(self.received)
+            if i < MAX_SAMPLES:
+                self.latencies[i] = now - sent_at
+
+    def result(self):
+        return {"connected": self.connected, "failed": self.failed, "sent": self.sent,
+                "received": self.received, "received_bytes": self.received_bytes, "wire_bytes": self.wire_bytes,
+                "latencies": self.latencies.tobytes()}
+
+
+def make_message(size):
+    """A load message of about size bytes carrying its send time."""
+    head = f"{MARKER}{time.monotonic_ns()} "
+    return head + "x" * max(0, size - len(head))
+
+
+def run_process(clients, senders, args, start_barrier, results):
+    """Connects this process's clients, runs the load and puts its Stats result in results."""
+    raise_open_file_limit()
+    stats = Stats()
+    simulated = []
+    for _ in range(clients):
+        connection = ChatConnection(args.host, args.port, history=0, caps=[cap for cap in args.caps.split(",") if cap],
+                                    unix_path=args.unix)
+        try:
+            connection.connect()
+        except OSError:
+            stats.failed += 1
+            continue
+        connection.socket.setblocking(False)
+        simulated.append(SimulatedClient(connection, stats))
+    stats.connected = len(simulated)
+
+    selector = selectors.DefaultSelector()
+    for simulated_client in simulated:
+        selector.register(simulated_client, selectors.EVENT_READ)
+    sending = simulated[:senders]
+    interval = 1.0 / args.rate if args.rate > 0 else None
+
+    start_barrier.wait() #every process starts sending at the same time
+    start = time.monotonic()
+    for i, simulated_client in enumerate(sending): #spread the first sends over one interval
+        simulated_client.next_send = start + (interval or 0) * i / max(1, len(sending))
+    stop_sending = start + args.duration
+    stop = stop_sending + DRAIN_SECONDS
+
+    while True:
+        now = time.monotonic()
+        if now >= stop:
+            break
+        if interval is not None and now < stop_sending:
+            for simulated_client in sending:
+                while simulated_client.next_send <= now:
+                    simulated_client.outbound += protocol.encode_frame(protocol.CHAT, make_message(args.size))
+                    simulated_client.next_send += interval
+                    stats.sent += 1
+                write(selector, simulated_client)
+        for key, mask in selector.select(timeout=0.001):
+            simulated_client = key.fileobj
+            if mask & selectors.EVENT_WRITE:
+                write(selector, simulated_client)
+            if mask & selectors.EVENT_READ:
+                try:
+                    data = simulated_client.connection.socket.recv(protocol.RECV_SIZE)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data = b""
+                stats.wire_bytes += len(data)
+                if not data or not simulated_client.connection.handle_data(data):
+                    selector.unregister(simulated_client)
+                    simulated_client.connection.close()
+
+    for simulated_client in simulated:
+        simulated_client.connection.close()
+    results.put(stats.result())
+
+
+def write(selector, simulated_client):
+    """Sends what the socket takes and watches for EVENT_WRITE while anything is left."""
+    if simulated_client.outbound:
+        try:
+            sent = simulated_client.connection.socket.send(simulated_client.outbound)
+            del simulated_client.outbound[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            simulated_client.outbound.clear()
+    events = selectors.EVENT_READ | (selectors.EVENT_WRITE if simulated_client.outbound else 0)
+    try:
+        if selector.get_key(simulated_client).events != events:
+            selector.modify(simulated_client, events)
+    except KeyError:
+        pass #already unregistered
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running chat server.")
+    parser.add_argument("--clients", type=int, default=1000, help="simulated clients in total")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--senders", type=int, default=10, help="clients that send; all of them receive")
+    parser.add_argument("--rate", type=float, default=10.0, help="messages per second per sender")
+    parser.add_argument("--size", type=int, default=100, help="message size in bytes")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of sending")
+    parser.add_argument("--caps", default="batch,zlib", help="capabilities the clients offer; empty for plain frames")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--unix", help="connect to the server's Unix domain socket at this path instead")
+    args = parser.parse_args()
+
+    processes = max(1, min(args.processes, args.clients))
+    start_barrier = multiprocessing.Barrier(processes)
+    results = multiprocessing.Queue()
+    workers = []
+    for i in range(processes):
+        clients = args.clients // processes + (1 if i < args.clients % processes else 0)
+        senders = args.senders // processes + (1 if i < args.senders % processes else 0)
+        worker = multiprocessing.Process(target=run_process, args=(clients, senders, args, start_barrier, results))
+        worker.start()
+        workers.append(worker)
+    totals = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    connected = sum(total["connected"] for total in totals)
+    sent = sum(total["sent"] for total in totals)
+    received = sum(total["received"] for total in totals)
+    received_bytes = sum(total["received_bytes"] for total in totals)
+    wire_bytes = sum(total["wire_bytes"] for total in totals)
+    latencies = array("q")
+    for total in totals:
+        latencies.frombytes(total["latencies"])
+    ordered = sorted(latencies)
+    elapsed = args.duration + DRAIN_SECONDS
+
+    print(f"clients: {connected} connected, {sum(total['failed'] for total in totals)} failed")
+    print(f"sent: {sent} messages ({sent / args.duration:.0f}/s)")
+    print(f"received: {received} messages ({received / elapsed:.0f}/s, "
+          f"{received_bytes / elapsed / 1e6:.2f} MB/s of text, {wire_bytes / elapsed / 1e6:.2f} MB/s on the wire)")
+    if sent:
+        print(f"delivery: {received / (sent * max(1, connected - 1)):.1%} of sent x other clients")
+    print("latency ms: " + ", ".join(f"{name} {percentile(ordered, p) / 1e6:.2f}" for name, p in
+                                     (("p50", 0.50), ("p90", 0.90), ("p99", 0.99), ("p99.9", 0.999), ("max", 1.0))))
+
+
+if __name__ == "__main__":
+    main()
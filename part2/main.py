@@ -1,16 +1,26 @@
 #Content of main.py; use as is
 from tkinter import *
 import multiprocessing
-import time
+import os
+import socket
+import tempfile
 
 import client
 import server
 
 if __name__ == "__main__":
-    server = multiprocessing.Process(target=server.main)
+    serverWorkers = 1  #server processes sharing the port; more than 1 shards the clients over them (see shards.py)
+    #how the clients reach the server: "tcp", "unix" (a Unix domain socket) or "ring" (the Unix socket, plus
+    #a shared-memory ring the server writes each broadcast to once for every client; one server process only)
+    transport = "tcp"
+    unixPath = os.path.join(tempfile.gettempdir(), f"chat-{os.getpid()}.sock") if transport != "tcp" and hasattr(socket, "AF_UNIX") else None
+    ringName = f"chat-{os.getpid()}" if transport == "ring" and serverWorkers == 1 else None
+    serverReady = multiprocessing.Event()  #set by the server once it is listening
+    server = multiprocessing.Process(target=server.main, kwargs={"workers": serverWorkers, "unix_path": unixPath, "ring_name": ringName,
+                                                                 "ready": serverReady})
     server.start()
-    time.sleep(1)  #to ensure server is up and running; may be commented out or changed
+    serverReady.wait(timeout=10)  #the clients keep retrying on their own if the server takes longer
 
     numberOfClients = 2  #Change this value for a different number of clients
     for count in range(1, numberOfClients+1):
-        multiprocessing.Process(target=client.main, name=f"Client{count}").start()
+        multiprocessing.Process(target=client.main, name=f"Client{count}", kwargs={"unix_path": unixPath, "ring_name": ringName}).start()
@@ -0,0 +1,227 @@
+#Content of message_log.py; persistent chat history used by server.py
+
+"""The server appends every broadcast to a MessageLog. The log is a directory of
+   segments; each segment is a data file of records, stored exactly as the RECORD
+   frames sent to clients, and an index file with the byte offset of every record.
+   Records are numbered by a sequence number that keeps growing across segments
+   and server restarts, so a client can ask for the last N records or everything
+   after the last one it saw, and the server can send the answer straight from
+   the data files without reading it into memory.
+   One process writes a log; other processes may open it readonly to serve
+   history from the same files."""
+
+import bisect
+import mmap
+import os
+import struct
+
+import protocol
+
+SEGMENT_BYTES = 64 * 1024 * 1024 #a new segment is started once a data file would grow past this
+INDEX_ENTRIES = 1024 * 1024 #records per segment; the index file is pre-allocated for this many
+INDEX_ENTRY = struct.Struct("!Q") #offset of a record in its data file, plus one so 0 means unused
+
+
+def read_range(file, offset, length):
+    """Reads length bytes at offset of an unbuffered file without moving other readers (POSIX)."""
+    if hasattr(os, "pread"):
+        return os.pread(file.fileno(), length, offset)
+    file.seek(offset)
+    return file.read(length)
+
+
+class Segment:
+    """One data file and its memory-mapped index, holding records base.. base+count-1."""
+
+    def __init__(self, directory, base, index_entries=INDEX_ENTRIES, readonly=False):
+        self.base = base
+        self.readonly = readonly
+        name = os.path.join(directory, f"{base:020d}")
+        self.data_path = name + ".log"
+        self.index_path = name + ".idx"
+
+        #the index is created before the data file, so a reader that finds a data file finds its index
+        if readonly:
+            with open(self.index_path, "rb") as index_file:
+                self.index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.writer = None
+        else:
+            with open(self.index_path, "a+b") as index_file:
+                if os.path.getsize(self.index_path) < index_entries * INDEX_ENTRY.size:
+                    index_file.truncate(index_entries * INDEX_ENTRY.size) #pre-allocate the whole index once
+                self.index = mmap.mmap(index_file.fileno(), index_entries * INDEX_ENTRY.size)
+            self.writer = open(self.data_path, "ab", buffering=0) #unbuffered, so readers see every append
+        self.reader = open(self.data_path, "rb", buffering=0) #used by the server to send ranges of the file
+        self.capacity = len(self.index) // INDEX_ENTRY.size
+        self.count, self.size = self.recover()
+
+    def recover(self):
+        """Finds the indexed records and cuts off anything after the last complete one,
+           e.g. a record whose write was interrupted or that never made it into the index.
+           A readonly segment only counts the records; it changes nothing."""
+        low, high = 0, self.capacity
+        while low < high: #entries are filled in order, so the used ones are a prefix
+            middle = (low + high) // 2
+            if self.entry(middle):
+                low = middle + 1
+            else:
+                high = middle
+        count = low
+        data_size = os.path.getsize(self.data_path)
+        size = 0
+        while count:
+            offset = self.entry(count - 1) - 1
+            header = read_range(self.reader, offset, protocol.HEADER.size)
+            if len(header) == protocol.HEADER.size:
+                end = offset + protocol.HEADER.size + protocol.HEADER.unpack(header)[1]
+                if end <= data_size:
+                    size = end
+                    break
+            if not self.readonly:
+                INDEX_ENTRY.pack_into(self.index, (count - 1) * INDEX_ENTRY.size, 0) #incomplete record
+            count -= 1
+        if data_size > size and not self.readonly:
+            self.writer.truncate(size)
+        return count, size
+
+    def entry(self, i):
+        return INDEX_ENTRY.unpack_from(self.index, i * INDEX_ENTRY.size)[0]
+
+    def offset(self, seq):
+        """Byte offset of record seq in the data file; seq base+count is the end of the file."""
+        i = seq - self.base
+        return self.size if i >= self.count else self.entry(i) - 1
+
+    def full(self, record_size):
+        return self.count == self.capacity or (self.count and self.size + record_size > SEGMENT_BYTES)
+
+    def append(self, record):
+        """Writes a record; the index entry is written after the data, so a crash in between
+           leaves an unindexed tail that recover() removes."""
+        self.writer.write(record)
+        INDEX_ENTRY.pack_into(self.index, self.count * INDEX_ENTRY.size, self.size + 1)
+        self.count += 1
+        self.size += len(record)
+
+    def seal(self):
+        """Stops appending to this segment; it stays open for reading."""
+        if self.writer is not None:
+            self.writer.close()
+            self.index.flush()
+
+    def close(self):
+        if self.writer is not None and not self.writer.closed:
+            self.writer.close()
+        self.reader.close()
+        self.index.close()
+
+
+class MessageLog:
+    """
+    Append-only, segmented log of the frames broadcast by the server.
+    append() stores a frame as the next record and returns the RECORD frame to
+    broadcast, which is byte for byte what is in the data file. ranges() maps
+    a span of sequence numbers to (file, offset, length) byte ranges, which the
+    server hands to os.sendfile. Appends are written to the OS right away but
+    not fsynced, so a power cut may lose the last few records; a crash of the
+    server process loses nothing.
+    A readonly log follows a log that another process writes, which must
+    have opened it first. It serves the records before next_seq; the owner
+    moves next_seq on with advance() as it learns of new records, and the
+    segment files are looked at again only when a range needs it.
+    """
+
+    def __init__(self, directory, index_entries=INDEX_ENTRIES, readonly=False):
+        self.directory = directory
+        self.index_entries = index_entries
+        self.readonly = readonly
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+        self.segments = [Segment(directory, base, index_entries, readonly) for base in self.segment_bases()]
+        for segment in self.segments[:-1]:
+            segment.seal()
+        if not self.segments:
+            self.segments.append(Segment(directory, 0, index_entries))
+        self.bases = [segment.base for segment in self.segments]
+        last = self.segments[-1]
+        self.next_seq = last.base + last.count
+
+    def segment_bases(self):
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                      if name.endswith(".log") and name[:-4].isdigit())
+
+    @property
+    def first_seq(self):
+        return self.segments[0].base
+
+    def __len__(self):
+        return self.next_seq - self.first_seq
+
+    def append(self, frame):
+        """Logs an encoded frame and returns it wrapped as the RECORD frame with its sequence number."""
+        record = protocol.encode_record(self.next_seq, frame)
+        segment = self.segments[-1]
+        if segment.full(len(record)):
+            segment.seal()
+            segment = Segment(self.directory, self.next_seq, self.index_entries)
+            self.segments.append(segment)
+            self.bases.append(segment.base)
+        segment.append(record)
+        self.next_seq += 1
+        return record
+
+    def advance(self, next_seq):
+        """Readonly logs: records up to next_seq - 1 have been written by the owner."""
+        self.next_seq = max(self.next_seq, next_seq)
+
+    def refresh(self):
+        """Readonly logs: picks up the records and segments written since the last look.
+           The segment list is read first; the writer seals a segment before starting the
+           next one, so every segment before a listed one is complete when it is recounted."""
+        bases = self.segment_bases()
+        last = self.segments[-1]
+        last.count, last.size = last.recover()
+        for base in bases:
+            if base > last.base:
+                segment = Segment(self.directory, base, self.index_entries, readonly=True)
+                self.segments.append(segment)
+                self.bases.append(base)
+
+    def clamp(self, start, stop=None):
+        """Limits [start, stop) to the records in the log."""
+        stop = self.next_seq if stop is None else min(stop, self.next_seq)
+        return max(start, self.first_seq), stop
+
+    def last(self, n):
+        """Returns the [start, stop) sequence numbers of the last n records."""
+        return self.clamp(self.next_seq - n)
+
+    def after(self, seq):
+        """Returns the [start, stop) sequence numbers of the records after seq."""
+        return self.clamp(seq + 1)
+
+    def ranges(self, start, stop):
+        """Returns the records start..stop-1 as a list of (file, offset, length), one per segment."""
+        start, stop = self.clamp(start, stop)
+        last = self.segments[-1]
+        if self.readonly and stop > last.base + last.count:
+            self.refresh()
+        ranges = []
+        i = bisect.bisect_right(self.bases, start) - 1
+        while start < stop and i < len(self.segments):
+            segment = self.segments[i]
+            end = min(stop, segment.base + segment.count)
+            if end > start:
+                offset = segment.offset(start)
+                ranges.append((segment.reader, offset, segment.offset(end) - offset))
+                start = end
+            i += 1
+        return ranges
+
+    def read(self, start, stop):
+        """Returns the bytes of records start..stop-1."""
+        return b"".join(read_range(file, offset, length) for file, offset, length in self.ranges(start, stop))
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
@@ -0,0 +1,217 @@
+#Content of protocol.py; wire protocol shared by client.py and server.py
+
+"""Every message between the chat server and a client is sent as a frame:
+   a 5 byte header (1 byte frame type, 4 byte big-endian payload length)
+   followed by the payload. Text payloads are UTF-8.
+   A client may send HELLO with the capabilities it supports; the server
+   answers with CAPS, the ones both sides will use. With "batch" several
+   frames may travel in one BATCH frame, and with "zlib" in one COMPRESSED
+   frame. Peers that never send HELLO only get plain frames."""
+
+import struct
+import zlib
+
+HEADER = struct.Struct("!BI")
+MAX_PAYLOAD = 16 * 1024 * 1024 #larger frames are treated as a corrupt stream
+RECV_SIZE = 65536 #bytes asked from recv at a time; any number of frames may arrive in one read
+
+#frame types
+CHAT = 1       #chat text; client -> server: the message, server -> client: "Client N: message"
+#2 was JOIN; joins are only logged by the server now, and the number is not reused
+LEAVE = 3      #server -> client: id of a client that left the chat; client -> server (empty): leaving for good
+ASSIGN_ID = 4  #server -> client: the receiving client's own id
+RECORD = 5     #server -> client: a logged broadcast, its sequence number (8 bytes) followed by the whole frame
+HISTORY = 6    #client -> server: asks for logged records, see encode_history_request
+HISTORY_END = 7  #server -> client: the requested records have all been sent; payload is the next sequence number (8 bytes)
+HELLO = 8      #client -> server: the capabilities the client supports, comma separated
+CAPS = 9       #server -> client: the capabilities both sides will use, comma separated
+BATCH = 10     #several complete frames, one after the other
+COMPRESSED = 11  #the next piece of the sender's zlib stream; it inflates to complete frames
+RING_START = 12  #server -> client: broadcasts now come through the shared-memory ring, from this write position (8 bytes) on
+SESSION = 13   #server -> client: the session token to resume with after a lost connection
+RESUME = 14    #client -> server: a session token and a history request, see encode_resume;
+               #server -> client: the resumed session's client id, or empty if it could not be resumed
+ROOM_JOIN = 15   #client -> server: joins the room named in the payload; server -> client: the client is in it now
+ROOM_LEAVE = 16  #client -> server: leaves the room named in the payload; server -> client: the client is out of it now
+ROOM_CHAT = 17   #see encode_addressed; client -> server: room and message, server -> client: room and "Client N: message"
+DIRECT = 18      #see encode_addressed; client -> server: recipient's id and message, server -> client: sender's id and message
+ERROR = 19       #server -> client: why a request of the client was refused, as text
+
+#capabilities
+CAP_BATCH = "batch"
+CAP_ZLIB = "zlib" #compression with PRESET_DICT; changing the dictionary needs a new capability name
+CAP_RING = "ring" #broadcasts are read from the server's shm_ring instead of the socket (same machine only)
+CAP_RESUME = "resume" #the server hands out a SESSION token, with which a reconnecting client keeps its id
+
+ZLIB_WBITS = 12 #4 KiB window: plenty for chat lines, and 32 KiB of compressor state per connection
+ZLIB_MEMLEVEL = 5
+COMPRESS_MIN_BYTES = 512 #smaller packs are sent as BATCH; compressing a lone message costs more than it saves
+
+#preset dictionary for the zlib streams: common chat phrasing and frame bytes, the most common last
+PRESET_DICT = (
+    b"what do you think? I don't know. sounds good, see you later! thank you thanks "
+    b"how are you? I'm good. yes no okay ok lol haha :) hello hi hey everyone "
+    b"has joined the chat. has left the chat. \x07\x00\x00\x00\x08\x03\x00\x00\x00 "
+    b"\x05\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00Client 1: Client 2: Client 3: Client "
+)
+
+RECORD_SEQ = struct.Struct("!Q")
+HISTORY_REQUEST = struct.Struct("!BQ")
+HISTORY_LAST = 0   #the last N records
+HISTORY_AFTER = 1  #every record with a sequence number greater than N
+SESSION_TOKEN_BYTES = 16
+
+LOBBY = "lobby" #the room every client starts in; its messages are the CHAT broadcasts, which are logged
+ADDRESS_LENGTH = struct.Struct("!B")
+MAX_NAME_BYTES = 255 #of a room name or client id in an addressed frame
+
+
+class ProtocolError(Exception):
+    """Raised when the byte stream cannot be split into valid frames."""
+
+
+def encode_frame(frame_type, payload=b""):
+    """Returns the bytes of one frame; str payloads are encoded as UTF-8."""
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    return HEADER.pack(frame_type, len(payload)) + payload
+
+
+def encode_record(seq, frame):
+    """Wraps an encoded frame in a RECORD frame with its sequence number in the message log."""
+    return encode_frame(RECORD, RECORD_SEQ.pack(seq) + frame)
+
+
+def decode_record(payload):
+    """Returns (seq, frame_type, payload) of the frame inside a RECORD payload."""
+    if len(payload) < RECORD_SEQ.size + HEADER.size:
+        raise ProtocolError("record too short")
+    seq, = RECORD_SEQ.unpack_from(payload)
+    frame_type, length = HEADER.unpack_from(payload, RECORD_SEQ.size)
+    start = RECORD_SEQ.size + HEADER.size
+    if start + length != len(payload):
+        raise ProtocolError("record length does not match its frame")
+    return seq, frame_type, payload[start:]
+
+
+def encode_history_request(mode, value):
+    """Returns a HISTORY frame asking for the last value records (HISTORY_LAST) or the
+       records after sequence number value (HISTORY_AFTER)."""
+    return encode_frame(HISTORY, HISTORY_REQUEST.pack(mode, value))
+
+
+def encode_resume(token, mode, value):
+    """Returns a RESUME frame: the session's token, then the records to replay as in a HISTORY
+       request. The records are replayed whether or not the session can be resumed."""
+    return encode_frame(RESUME, token + HISTORY_REQUEST.pack(mode, value))
+
+
+def encode_addressed(frame_type, name, text):
+    """Returns a ROOM_CHAT or DIRECT frame: the length of the UTF-8 name (1 byte), the name
+       and the text. Raises ValueError if the name is empty or longer than MAX_NAME_BYTES."""
+    name = name.encode("utf-8")
+    if not 0 < len(name) <= MAX_NAME_BYTES:
+        raise ValueError(f"names must be 1 to {MAX_NAME_BYTES} bytes")
+    if isinstance(text, str):
+        text = text.encode("utf-8")
+    return encode_frame(frame_type, ADDRESS_LENGTH.pack(len(name)) + name + text)
+
+
+def decode_addressed(payload):
+    """Returns the (name, text) of a ROOM_CHAT or DIRECT payload as str."""
+    if not payload or len(payload) < ADDRESS_LENGTH.size + payload[0] or payload[0] == 0:
+        raise ProtocolError("malformed addressed frame")
+    end = ADDRESS_LENGTH.size + payload[0]
+    return payload[ADDRESS_LENGTH.size:end].decode("utf-8", "replace"), payload[end:].decode("utf-8", "replace")
+
+
+def encode_caps(frame_type, caps):
+    """Returns a HELLO or CAPS frame listing caps."""
+    return encode_frame(frame_type, ",".join(sorted(caps)))
+
+
+def decode_caps(payload):
+    return frozenset(cap for cap in payload.decode("ascii", "replace").split(",") if cap)
+
+
+def split_frames(buffer, frames, offset=0):
+    """Appends every complete (frame_type, payload) in buffer from offset to frames and
+       returns the offset of the first byte not used."""
+    while len(buffer) - offset >= HEADER.size:
+        frame_type, length = HEADER.unpack_from(buffer, offset)
+        if length > MAX_PAYLOAD:
+            raise ProtocolError(f"frame of {length} bytes is larger than {MAX_PAYLOAD}")
+        end = offset + HEADER.size + length
+        if end > len(buffer):
+            break #rest of this frame has not arrived yet
+        frames.append((frame_type, bytes(buffer[offset + HEADER.size:end])))
+        offset = end
+    return offset
+
+
+class FramePacker:
+    """Packs frames into one BATCH frame, or with compress into one COMPRESSED frame
+       if they add up to COMPRESS_MIN_BYTES. The COMPRESSED frames of a packer continue
+       one zlib stream, so later messages are compressed against the earlier ones; each
+       is flushed with Z_SYNC_FLUSH so it can be inflated as soon as it arrives, and they
+       must all be sent, in order. The stream is only set up when first needed."""
+
+    def __init__(self, compress):
+        self.compress = compress
+        self.compressor = None
+
+    def worth_packing(self, frame_count, size):
+        return frame_count > 1 or (self.compress and size >= COMPRESS_MIN_BYTES)
+
+    def pack(self, frames):
+        data = b"".join(frames)
+        if not self.compress or len(data) < COMPRESS_MIN_BYTES:
+            return encode_frame(BATCH, data)
+        if self.compressor is None:
+            self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, ZLIB_WBITS,
+                                               ZLIB_MEMLEVEL, zdict=PRESET_DICT)
+        return encode_frame(COMPRESSED, self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH))
+
+
+class FrameDecoder:
+    """Reassembles frames from a byte stream. Data is fed in as it comes from recv,
+       however TCP split or merged it; complete frames are returned and any partial
+       frame is kept until the rest of it arrives. BATCH and COMPRESSED frames are
+       unpacked, so callers only see the frames inside them."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.inflater = None #the sender's zlib stream, from its first COMPRESSED frame on
+
+    def feed(self, data):
+        """Adds received bytes and returns a list of (frame_type, payload) for every
+           frame now complete."""
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        del buffer[:split_frames(buffer, frames)]
+        if any(frame_type in (BATCH, COMPRESSED) for frame_type, _ in frames):
+            frames = self.unpack(frames)
+        return frames
+
+    def unpack(self, frames):
+        unpacked = []
+        for frame_type, payload in frames:
+            if frame_type == COMPRESSED:
+                if self.inflater is None:
+                    self.inflater = zlib.decompressobj(ZLIB_WBITS, zdict=PRESET_DICT)
+                try:
+                    payload = self.inflater.decompress(payload, MAX_PAYLOAD)
+                except zlib.error as e:
+                    raise ProtocolError(f"bad compressed frame: {e}")
+                if self.inflater.unconsumed_tail:
+                    raise ProtocolError(f"compressed frame inflates to more than {MAX_PAYLOAD} bytes")
+            elif frame_type != BATCH:
+                unpacked.append((frame_type, payload))
+                continue
+            start = len(unpacked)
+            if split_frames(payload, unpacked) != len(payload):
+                raise ProtocolError("packed frames do not end on a frame boundary")
+            if any(inner_type in (BATCH, COMPRESSED) for inner_type, _ in unpacked[start:]):
+                raise ProtocolError("packed frames cannot be nested")
+        return unpacked
@@ -4,30 +4,820 @@
 #Content of server.py; To complete/implement
 
 from tkinter import *
+import contextlib
+import os
+import secrets
+import selectors
 import socket
+import sys
 import threading
+import time
+from collections import deque
+from itertools import count, islice, takewhile
+
+import protocol
+import shm_ring
+from admin import ADMIN_PORT, AdminServer, ServerMetrics
+from message_log import MessageLog
+
+HOST = '127.0.0.1'
+PORT = 12345
+BACKLOG = 4096 #pending connections the kernel may queue before they are accepted
+
+MAX_OUTBOUND_BYTES = 1024 * 1024 #bytes that may wait for one client before SLOW_CLIENT_POLICY applies
+#what happens to a message for a client whose outbound buffer is full:
+#"drop" skips the new message, "coalesce" drops the oldest waiting messages to make room,
+#"disconnect" closes the slow client
+SLOW_CLIENT_POLICY = "coalesce"
+#the frames the policy may drop: chat data. Control frames (HISTORY_END, CAPS, RING_START, SESSION,
+#RESUME, ROOM_JOIN, ERROR, ...) are always queued; they are small and clients depend on every one
+DROPPABLE_FRAMES = frozenset((protocol.CHAT, protocol.LEAVE, protocol.RECORD, protocol.ROOM_CHAT, protocol.DIRECT))
+SEND_BATCH = 64 #frames handed to one sendmsg call, or packed into one frame for clients that can take it
+PACK_BYTES = 64 * 1024 #bytes of frames packed into one BATCH or COMPRESSED frame at most
+SERVER_CAPS = frozenset((protocol.CAP_BATCH, protocol.CAP_ZLIB, protocol.CAP_RESUME)) #capabilities offered to clients that send HELLO
+HAVE_SENDMSG = hasattr(socket.socket, "sendmsg") #scatter-gather writes (not on Windows)
+HAVE_SENDFILE = hasattr(os, "sendfile") #file to socket copies in the kernel (POSIX)
+HAVE_UNIX = hasattr(socket, "AF_UNIX") #Unix domain sockets for clients on the same machine
+
+HISTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history") #where the message log is kept
+SERVER_WORKERS = 1 #server processes sharing the port; more than one runs the sharded server of shards.py
+RESUME_SECONDS = 60 #how long a client that lost its connection may come back as the same client
+MAX_ROOMS_PER_CLIENT = 64 #rooms one client may be in at a time, the lobby included
+
+LOG_HISTORY_LINES = 1000 #lines kept in the server's chat history widget
+LOG_REFRESH_MS = 50 #how often the GUI draws the lines logged since the last frame
+
+
+class ClientConnection:
+    """State the server keeps for one connected client socket."""
+
+    def __init__(self, client_socket, client_id, number=0):
+        self.socket = client_socket
+        self.client_id = client_id
+        self.number = number #the N of "Client N"; 0 for connections that are not clients
+        self.decoder = protocol.FrameDecoder() #reassembles frames from this client
+        #frames not yet accepted by the socket, as memoryviews shared with the other
+        #recipients of the same broadcast, and FileRanges of history; the first one may be partly sent
+        self.outbound = deque()
+        self.outbound_bytes = 0 #bytes of the memoryviews; FileRanges take no memory and are not counted
+        self.head_committed = False #the first item is partly sent or packed, so it must go out whole
+        self.caps = frozenset() #capabilities agreed in the HELLO / CAPS exchange
+        self.packer = None #protocol.FramePacker once the client accepts batched frames
+        self.want_write = False #registered for EVENT_WRITE
+        self.dropped = 0 #messages skipped by the slow client policy
+        self.closed = False
+        self.lossless = False #links between server processes are exempt from the slow client policy
+        self.ring_reader = False #reads broadcasts from the server's shared-memory ring, not the socket
+        self.session = None #token the client can resume this connection's id with
+        self.rooms = set() #names of the rooms the client is in; kept after it disconnects, for a resume
+        #counters for the admin socket (admin.py)
+        self.connected_at = time.monotonic()
+        self.messages_in = 0 #frames received
+        self.bytes_in = 0
+        self.messages_out = 0 #frames queued
+        self.bytes_out = 0 #bytes written to the socket
+
+
+class FileRange:
+    """A byte range of the message log waiting in a client's outbound buffer. It is
+       not read into memory; the socket gets it straight from the file when it can
+       take more data, so replaying history costs the server no buffer space."""
+
+    def __init__(self, file, offset, length):
+        self.file = file
+        self.offset = offset
+        self.length = length
+
+    def send_to(self, client_socket):
+        """Sends as much of the range as the socket takes and returns the bytes sent."""
+        if HAVE_SENDFILE:
+            sent = os.sendfile(client_socket.fileno(), self.file.fileno(), self.offset, self.length)
+        else:
+            self.file.seek(self.offset)
+            sent = client_socket.send(self.file.read(min(self.length, protocol.RECV_SIZE)))
+        if sent == 0:
+            raise ConnectionResetError("history file ended early")
+        self.offset += sent
+        self.length -= sent
+        return sent
+
+
+class ClientRegistry:
+    """
+    The set of connected clients, safe to read from any thread.
+    join() and leave() change it atomically under a lock and assign ids from a
+    monotonic counter. Readers on the broadcast path iterate snapshot(), an
+    immutable tuple that is rebuilt at most once per change, so they never
+    see the registry change size under them and take the lock only when a
+    join or leave happened since the last snapshot. get() and find() are
+    plain dict lookups, which need no lock.
+    """
+
+    def __init__(self, first_id=1, id_step=1):
+        self.lock = threading.Lock()
+        self.ids = count(first_id, id_step) #server workers use different first ids with the same step
+        self.clients = {} #socket -> ClientConnection
+        self.numbers = {} #client number -> ClientConnection, for direct messages
+        self.current = () #latest snapshot, or None after a change
+
+    def next_id(self):
+        """Returns the next client number; numbers are never reused."""
+        with self.lock:
+            return next(self.ids)
+
+    def join(self, connection):
+        with self.lock:
+            self.clients[connection.socket] = connection
+            if connection.number:
+                self.numbers[connection.number] = connection
+            self.current = None
+
+    def leave(self, client_socket):
+        """Removes a client and returns its connection, or None if it already left."""
+        with self.lock:
+            connection = self.clients.pop(client_socket, None)
+            if connection is not None:
+                self.current = None
+                if self.numbers.get(connection.number) is connection:
+                    del self.numbers[connection.number]
+            return connection
+
+    def renumber(self, connection, number):
+        """Gives a connected client another number, e.g. the one of the session it resumed."""
+        with self.lock:
+            if self.numbers.get(connection.number) is connection:
+                del self.numbers[connection.number]
+            connection.number = number
+            self.numbers[number] = connection
+
+    def get(self, client_socket):
+        return self.clients.get(client_socket)
+
+    def find(self, number):
+        """Returns the connection of client number, or None if it is not connected."""
+        return self.numbers.get(number)
+
+    def snapshot(self):
+        """Returns a tuple of the connected clients that later changes do not affect."""
+        current = self.current
+        if current is None:
+            with self.lock:
+                if self.current is None:
+                    self.current = tuple(self.clients.values())
+                current = self.current
+        return current
+
+    def __len__(self):
+        return len(self.clients)
+
+
+class RoomIndex:
+    """
+    Which clients are in which room, so a message to a room is sent to its
+    members only and costs O(members), not O(connected clients). A room's
+    members are kept in a dict (ordered, O(1) join and leave); fan-out
+    iterates a tuple snapshot of them, rebuilt at most once per change. A
+    room exists while it has members. Only the server thread uses it.
+    """
+
+    def __init__(self):
+        self.members = {} #room name -> {ClientConnection: None}
+        self.snapshots = {} #room name -> tuple of its members
+
+    def join(self, connection, room):
+        members = self.members.setdefault(room, {})
+        if connection not in members:
+            members[connection] = None
+            self.snapshots.pop(room, None)
+        connection.rooms.add(room)
+
+    def leave(self, connection, room):
+        connection.rooms.discard(room)
+        self.remove(connection, room)
+
+    def detach(self, connection):
+        """Takes a disconnected client out of every room's members; connection.rooms is
+           kept, so a resumed session can rejoin them."""
+        for room in connection.rooms:
+            self.remove(connection, room)
+
+    def remove(self, connection, room):
+        members = self.members.get(room)
+        if members is not None and connection in members:
+            del members[connection]
+            self.snapshots.pop(room, None)
+            if not members:
+                del self.members[room]
+
+    def snapshot(self, room):
+        """Returns the members of a room as a tuple that later changes do not affect."""
+        snapshot = self.snapshots.get(room)
+        if snapshot is None:
+            snapshot = self.snapshots[room] = tuple(self.members.get(room, ()))
+        return snapshot
+
+    def __len__(self):
+        return len(self.members)
+
+
+class ChatServerCore:
+    """
+    This class is the chat server without any GUI.
+    One thread runs serve_forever(), which uses a selector to multiplex the
+    listening socket and every client socket, so the number of connections
+    is not limited by the number of threads. All sockets are non-blocking;
+    data a client cannot take right away is kept in its outbound buffer and
+    sent when the socket becomes writable. Each client's buffer is bounded by
+    MAX_OUTBOUND_BYTES, and SLOW_CLIENT_POLICY decides what a client that
+    falls behind loses, so one stalled client never holds up the others.
+    Every line of the chat log (messages, joins and leaves) is passed to the
+    observers added with add_observer, e.g. the Tk window of ChatServer.
+    Observers are called on the server thread and must not block.
+    Every broadcast is also appended to a MessageLog in history_dir (None
+    turns this off) and sent as a RECORD frame carrying its sequence number.
+    Clients ask for earlier records with HISTORY frames; the answer is queued
+    as FileRanges and sent from the log files.
+    Clients on the same machine may also connect to a Unix domain socket at
+    unix_path (or one passed in as unix_socket). With ring_name, the server
+    writes every broadcast once into a shared-memory ring of that name, and
+    clients that negotiate "ring" read it from there instead of getting it
+    on their socket.
+    Clients that negotiate "resume" get a session token. When such a client's
+    connection is lost, its leave is held back for RESUME_SECONDS; if it
+    reconnects with RESUME in that time, it keeps its id, and either way it is
+    sent the messages it missed from the log.
+    Every client starts in the lobby room, whose messages are the broadcasts
+    above. Clients can join and leave other rooms, whose messages go to their
+    members only, and send direct messages to one client. Room and direct
+    messages are delivered live only; they are not logged.
+    The server thread counts what it does in metrics and in each
+    ClientConnection; an admin.AdminServer reports the counters.
+    """
+
+    def __init__(self, host=HOST, port=PORT, backlog=BACKLOG, slow_client_policy=SLOW_CLIENT_POLICY,
+                 max_outbound_bytes=MAX_OUTBOUND_BYTES, history_dir=HISTORY_DIR, server_socket=None,
+                 reuse_port=False, first_id=1, id_step=1, unix_path=None, unix_socket=None, ring_name=None):
+        if slow_client_policy not in ("drop", "coalesce", "disconnect"):
+            raise ValueError(f"unknown slow client policy: {slow_client_policy}")
+        self.slow_client_policy = slow_client_policy
+        self.max_outbound_bytes = max_outbound_bytes
+        self.selector = selectors.DefaultSelector()
+
+        #create a non-blocking listening socket, unless one is passed in or host is None (no listening)
+        if server_socket is None and host is not None:
+            server_socket = create_server_socket(host, port, backlog, reuse_port)
+        self.serverSocket = server_socket
+        if server_socket is not None:
+            server_socket.setblocking(False)
+            self.selector.register(server_socket, selectors.EVENT_READ, self.accept_client_connection)
+
+        #the same for the Unix domain socket, if any; unix_path is removed again on close
+        self.unix_path = unix_path if unix_socket is None else None
+        if unix_socket is None and unix_path is not None:
+            unix_socket = create_unix_server_socket(unix_path, backlog)
+        self.unixSocket = unix_socket
+        if unix_socket is not None:
+            unix_socket.setblocking(False)
+            self.selector.register(unix_socket, selectors.EVENT_READ, self.accept_client_connection)
+
+        #lets other threads wake the selector, e.g. to stop the server
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ, self.drain_wakeup)
+
+        self.clients = ClientRegistry(first_id, id_step) #every client chatting
+        self.rooms = RoomIndex()
+        self.failed = [] #connections whose socket failed; closed after the current event
+        self.queued = [] #connections with frames queued in this pass of the event loop
+        self.observers = []
+        self.running = False
+        self.sessions = {} #token -> ClientConnection of the clients that can resume
+        self.detached = {} #token -> (closed ClientConnection, deadline), in deadline order
+        self.message_log = MessageLog(history_dir) if history_dir is not None else None
+        self.ring = shm_ring.RingWriter(ring_name) if ring_name is not None else None
+        self.caps = SERVER_CAPS | {protocol.CAP_RING} if self.ring is not None else SERVER_CAPS
+        self.metrics = ServerMetrics()
+        self.admin = None #the admin.AdminServer reporting on this core, if any; closed with it
+        self.fan_out_starts = [] #perf_counter_ns() of the fan-outs in this pass of the event loop
+
+    def add_observer(self, observer):
+        """Registers a callable that is given each new chat log line."""
+        self.observers.append(observer)
+
+    def log(self, line):
+        for observer in self.observers:
+            observer(line)
+
+    def serve_forever(self):
+        """Runs the event loop until stop() is called."""
+        self.running = True
+        while self.running:
+            events = self.selector.select(self.select_timeout())
+            start = time.perf_counter_ns()
+            for key, mask in events:
+                key.data(key.fileobj, mask)
+                self.disconnect_failed()
+            self.flush_queued()
+            self.disconnect_failed()
+            self.expire_sessions()
+            self.record_pass(start)
+        self.close()
+
+    def select_timeout(self):
+        """Seconds until the first detached session expires, or None to wait for events only."""
+        for _, deadline in self.detached.values():
+            return max(0.0, deadline - time.monotonic())
+        return None
+
+    def expire_sessions(self):
+        """Lets the clients that did not come back in time leave the chat."""
+        now = time.monotonic()
+        while self.detached:
+            token, (connection, deadline) = next(iter(self.detached.items()))
+            if deadline > now:
+                break
+            del self.detached[token]
+            self.leave(connection)
+
+    def record_pass(self, start):
+        """Adds the pass of the event loop that began at start, and the fan-outs in it, to the histograms."""
+        end = time.perf_counter_ns()
+        self.metrics.loop_pass.add(end - start)
+        if self.fan_out_starts:
+            for fan_out_start in self.fan_out_starts:
+                self.metrics.fan_out.add(end - fan_out_start)
+            self.fan_out_starts.clear()
+
+    def stop(self):
+        """Stops serve_forever; may be called from any thread."""
+        self.running = False
+        try:
+            self.wakeup_writer.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def drain_wakeup(self, wakeup_socket, mask):
+        try:
+            wakeup_socket.recv(4096)
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        for connection in self.clients.snapshot():
+            self.clients.leave(connection.socket)
+            connection.socket.close()
+        self.selector.close()
+        if self.serverSocket is not None:
+            self.serverSocket.close()
+        if self.unixSocket is not None:
+            self.unixSocket.close()
+            if self.unix_path is not None:
+                with contextlib.suppress(FileNotFoundError): #e.g. removed by hand while the server ran
+                    os.unlink(self.unix_path)
+        self.wakeup_reader.close()
+        self.wakeup_writer.close()
+        if self.message_log is not None:
+            self.message_log.close()
+        if self.ring is not None:
+            self.ring.close()
+        if self.admin is not None:
+            self.admin.close()
+
+    def accept_client_connection(self, server_socket, mask):
+        """ It accepts every pending connection, assigns each client a unique id
+            and registers its socket with the selector."""
+        while True:
+            try:
+                client_socket, addr = server_socket.accept() #accepts connection
+            except BlockingIOError:
+                return #no more pending connections
+            except OSError:
+                self.metrics.accept_errors += 1
+                return #e.g. out of file descriptors; retried on the next wakeup
+            client_socket.setblocking(False)
+            self.metrics.accepts += 1
+
+            number = self.clients.next_id() #assigns number to client for id purposes
+            client_id = f"Client {number}"
+            connection = ClientConnection(client_socket, client_id, number)
+            self.clients.join(connection) #add client to list of active connections
+            self.rooms.join(connection, protocol.LOBBY)
+            self.selector.register(client_socket, selectors.EVENT_READ, self.handle_client_event)
+
+            self.send(connection, protocol.encode_frame(protocol.ASSIGN_ID, client_id)) # Send client their unique ID
+            #joins are only logged; announcing each one to every client would make connecting N clients O(N^2)
+            self.log(f"{client_id} has joined the chat.")
+
+    def handle_client_event(self, client_socket, mask):
+        connection = self.clients.get(client_socket)
+        if connection is None:
+            return
+        if mask & selectors.EVENT_WRITE:
+            self.flush(connection)
+        if mask & selectors.EVENT_READ and not connection.closed:
+            self.receive_message(connection)
+
+    def receive_message(self, connection):
+        """It handles the frames received from a client and broadcasts its messages to all other clients.
+           It also deals with client disconnections"""
+        try:
+            data = connection.socket.recv(protocol.RECV_SIZE)
+            if not data:
+                raise ConnectionResetError #client closed the connection
+            frames = connection.decoder.feed(data)
+        except BlockingIOError:
+            return
+        except (ConnectionResetError, BrokenPipeError, OSError, protocol.ProtocolError):
+            self.disconnect(connection)
+            return
+
+        connection.messages_in += len(frames)
+        connection.bytes_in += len(data)
+        self.metrics.messages_in += len(frames)
+        self.metrics.bytes_in += len(data)
+        for frame_type, payload in frames:
+            self.handle_frame(connection, frame_type, payload)
+
+    def handle_frame(self, connection, frame_type, payload):
+        """Acts on one frame received from a client."""
+        if frame_type == protocol.HELLO:
+            self.negotiate(connection, payload)
+        elif frame_type == protocol.HISTORY:
+            self.send_history(connection, payload)
+        elif frame_type == protocol.RESUME:
+            self.resume(connection, payload)
+        elif frame_type == protocol.LEAVE: #the client is going away for good; no need to wait for it
+            self.sessions.pop(connection.session, None)
+            connection.session = None
+            self.disconnect(connection)
+        elif frame_type == protocol.ROOM_JOIN:
+            self.join_room(connection, payload.decode("utf-8", "replace"))
+        elif frame_type == protocol.ROOM_LEAVE:
+            self.leave_room(connection, payload.decode("utf-8", "replace"))
+        elif frame_type == protocol.ROOM_CHAT:
+            self.room_chat(connection, payload)
+        elif frame_type == protocol.DIRECT:
+            self.direct_chat(connection, payload)
+        elif frame_type == protocol.CHAT:
+            if protocol.LOBBY not in connection.rooms: #the lobby is a room like any other; only members talk in it
+                self.send(connection, protocol.encode_frame(protocol.ERROR, f"You are not in room {protocol.LOBBY}; the message was not sent."))
+                return
+            #format message and dispaly it in the chat history
+            full_message = f"{connection.client_id}: {payload.decode('utf-8', 'replace')}"
+            self.log(full_message)
+            self.broadcast_message(protocol.encode_frame(protocol.CHAT, full_message), connection.number) #broadcasts message to the other clients
+
+    def broadcast_message(self, frame, sender_number=0):
+        """ server broadcasts an encoded frame to the other clients excluding the sender,
+            client number sender_number. The frame is logged first and sent as its RECORD frame.
+            Ring readers get it from the ring, where it is tagged with the sender's number
+            so the sender can skip it. """
+        if self.message_log is not None:
+            try:
+                frame = self.message_log.append(frame)
+            except OSError as e: #e.g. disk full; the message still goes out, just not logged
+                self.log(f"Message log error: {e}")
+        if self.ring is not None:
+            self.ring.publish(frame, sender_number)
+        self.fan_out(frame, sender_number)
+
+    def fan_out(self, frame, sender_number=0):
+        """Queues a frame for every client in the lobby except client number sender_number and
+           the ring readers. The frame is shared by every recipient's outbound buffer, not copied."""
+        self.fan_out_starts.append(time.perf_counter_ns())
+        frame = memoryview(frame)
+        for connection in self.rooms.snapshot(protocol.LOBBY):
+            #makes sure the sender does not receive the message again
+            if connection.number != sender_number and not connection.ring_reader:
+                self.send(connection, frame)
+
+    def join_room(self, connection, room):
+        """Adds a client to a room and confirms it with ROOM_JOIN, or says why not with ERROR."""
+        if not room or len(room.encode("utf-8")) > protocol.MAX_NAME_BYTES:
+            self.send(connection, protocol.encode_frame(protocol.ERROR, f"Room names must be 1 to {protocol.MAX_NAME_BYTES} bytes."))
+            return
+        if room not in connection.rooms and len(connection.rooms) >= MAX_ROOMS_PER_CLIENT:
+            self.send(connection, protocol.encode_frame(protocol.ERROR, f"Cannot join {room}: you are in {MAX_ROOMS_PER_CLIENT} rooms already."))
+            return
+        self.rooms.join(connection, room)
+        self.send(connection, protocol.encode_frame(protocol.ROOM_JOIN, room))
+
+    def leave_room(self, connection, room):
+        """Takes a client out of a room and confirms it with ROOM_LEAVE."""
+        if room in connection.rooms:
+            self.rooms.leave(connection, room)
+            self.send(connection, protocol.encode_frame(protocol.ROOM_LEAVE, room))
+
+    def room_chat(self, connection, payload):
+        """A client's message to one of its rooms; a lobby message is a plain CHAT."""
+        try:
+            room, message = protocol.decode_addressed(payload)
+        except protocol.ProtocolError:
+            return
+        if room not in connection.rooms: #only members talk in a room
+            self.send(connection, protocol.encode_frame(protocol.ERROR, f"You are not in room {room}; the message was not sent."))
+            return
+        if room == protocol.LOBBY:
+            self.handle_frame(connection, protocol.CHAT, message.encode("utf-8"))
+            return
+        self.log(f"[{room}] {connection.client_id}: {message}")
+        self.send_to_room(room, protocol.encode_addressed(protocol.ROOM_CHAT, room, f"{connection.client_id}: {message}"),
+                          connection.number)
+
+    def direct_chat(self, connection, payload):
+        """A client's message to one other client, given by its id "Client N"."""
+        try:
+            recipient, message = protocol.decode_addressed(payload)
+        except protocol.ProtocolError:
+            return
+        number = recipient.rpartition(" ")[2]
+        if not number.isdigit() or int(number) == 0:
+            self.send(connection, protocol.encode_frame(protocol.ERROR, f"There is no client {recipient}; the message was not sent."))
+            return
+        self.log(f"{connection.client_id} -> {recipient}: {message}")
+        self.send_direct(int(number), protocol.encode_addressed(protocol.DIRECT, connection.client_id, message),
+                         connection.number)
+
+    def send_to_room(self, room, frame, sender_number=0):
+        """Sends a room message to the room's members except its sender."""
+        self.fan_out_room(room, frame, sender_number)
+
+    def fan_out_room(self, room, frame, sender_number=0):
+        self.fan_out_starts.append(time.perf_counter_ns())
+        frame = memoryview(frame)
+        for connection in self.rooms.snapshot(room):
+            if connection.number != sender_number:
+                self.send(connection, frame)
+
+    def send_direct(self, number, frame, sender_number=0):
+        """Sends a direct message to client number if it is connected, or else tells
+           client sender_number (if not 0) with ERROR that it was not sent."""
+        connection = self.clients.find(number)
+        if connection is not None:
+            self.send(connection, frame)
+        elif sender_number:
+            self.send_direct(sender_number, protocol.encode_frame(
+                protocol.ERROR, f"Client {number} is not connected; the message was not sent."))
+
+    def send(self, connection, frame):
+        """Queues a frame for a client, applying the slow client policy if its buffer
+           is full and the frame is one of DROPPABLE_FRAMES. If nothing was waiting, the client is written to at the end of this
+           pass of the event loop (flush_queued)."""
+        if connection.closed:
+            return
+        if isinstance(frame, FileRange):
+            size = 0
+        elif isinstance(frame, memoryview):
+            size = len(frame)
+        else:
+            frame = memoryview(frame)
+            size = len(frame)
+        if (connection.outbound_bytes + size > self.max_outbound_bytes and not connection.lossless
+                and size and frame[0] in DROPPABLE_FRAMES):
+            if self.slow_client_policy == "disconnect":
+                self.failed.append(connection)
+                return
+            if self.slow_client_policy == "drop":
+                connection.dropped += 1
+                return
+            self.make_room(connection, size)
+
+        was_idle = not connection.outbound
+        connection.outbound.append(frame)
+        connection.outbound_bytes += size
+        connection.messages_out += 1
+        self.metrics.messages_out += 1
+        if was_idle and not connection.want_write:
+            self.queued.append(connection)
+
+    def flush_queued(self):
+        """Writes to the clients that got frames during this pass of the event loop. Waiting
+           until the end of the pass lets everything queued for a client in it go out in one
+           write, and be packed into one frame for clients that negotiated batching."""
+        queued = self.queued
+        self.queued = []
+        for connection in queued:
+            if not connection.closed:
+                self.flush(connection)
+
+    def negotiate(self, connection, hello):
+        """Answers a HELLO with the capabilities both sides have. From then on the frames
+           waiting for the client are packed into one frame per write, compressed if it
+           takes zlib and they are large enough; the CAPS frame itself may already be packed.
+           A client that takes "ring" is told the ring's write position; every broadcast
+           from there on is in the ring and no longer sent on its socket."""
+        connection.caps = protocol.decode_caps(hello) & self.caps
+        self.send(connection, protocol.encode_caps(protocol.CAPS, connection.caps))
+        if protocol.CAP_RING in connection.caps:
+            self.send(connection, protocol.encode_frame(protocol.RING_START, protocol.RECORD_SEQ.pack(self.ring.position)))
+            connection.ring_reader = True
+        if protocol.CAP_RESUME in connection.caps and connection.session is None:
+            connection.session = secrets.token_bytes(protocol.SESSION_TOKEN_BYTES)
+            self.sessions[connection.session] = connection
+            self.send(connection, protocol.encode_frame(protocol.SESSION, connection.session))
+        if connection.caps & {protocol.CAP_BATCH, protocol.CAP_ZLIB}:
+            connection.packer = protocol.FramePacker(protocol.CAP_ZLIB in connection.caps)
+
+    def resume(self, connection, payload):
+        """Answers a RESUME: if the token belongs to a client that lost its connection (or
+           whose old connection the server has not noticed to be dead yet), this connection
+           takes over its id and session. Then the history asked for is replayed."""
+        token = payload[:protocol.SESSION_TOKEN_BYTES]
+        if token in self.detached:
+            previous, _ = self.detached.pop(token)
+        else:
+            previous = self.sessions.get(token)
+            if previous is connection:
+                previous = None
+            elif previous is not None:
+                self.close_connection(previous)
+        if previous is None:
+            self.send(connection, protocol.encode_frame(protocol.RESUME))
+        else:
+            if connection.session is not None:
+                del self.sessions[connection.session] #the session of this connection's HELLO
+            self.log(f"{previous.client_id} reconnected (as {connection.client_id}).")
+            connection.client_id = previous.client_id
+            self.clients.renumber(connection, previous.number)
+            for room in previous.rooms - connection.rooms:
+                self.rooms.join(connection, room)
+            for room in connection.rooms - previous.rooms:
+                self.rooms.leave(connection, room)
+            connection.session = token
+            self.sessions[token] = connection
+            self.send(connection, protocol.encode_frame(protocol.RESUME, connection.client_id))
+            self.send(connection, protocol.encode_frame(protocol.SESSION, token))
+        self.send_history(connection, payload[protocol.SESSION_TOKEN_BYTES:])
+
+    def pack(self, connection):
+        """Replaces the frames at the front of a client's outbound buffer with one packed
+           frame, up to SEND_BATCH frames or PACK_BYTES."""
+        outbound = connection.outbound
+        frames = []
+        size = 0
+        while outbound and isinstance(outbound[0], memoryview) and len(frames) < SEND_BATCH and size < PACK_BYTES:
+            frames.append(outbound.popleft())
+            size += len(frames[-1])
+        if not connection.packer.worth_packing(len(frames), size):
+            outbound.appendleft(frames[0]) #a lone small frame goes out as it is
+            return
+        packed = memoryview(connection.packer.pack(frames))
+        outbound.appendleft(packed)
+        connection.outbound_bytes += len(packed) - size
+        connection.head_committed = True #may be part of the zlib stream; it cannot be dropped
+
+    def send_history(self, connection, request):
+        """Answers a HISTORY request: the records asked for are queued as ranges of the
+           log files, followed by a HISTORY_END frame with the next sequence number."""
+        try:
+            mode, value = protocol.HISTORY_REQUEST.unpack(request)
+        except Exception:
+            return #malformed request
+        if self.message_log is None:
+            self.send(connection, protocol.encode_frame(protocol.HISTORY_END, protocol.RECORD_SEQ.pack(0)))
+            return
+        if mode == protocol.HISTORY_AFTER:
+            start, stop = self.message_log.after(value)
+        else:
+            start, stop = self.message_log.last(value)
+        for file, offset, length in self.message_log.ranges(start, stop):
+            self.send(connection, FileRange(file, offset, length))
+        self.send(connection, protocol.encode_frame(protocol.HISTORY_END, protocol.RECORD_SEQ.pack(stop)))
+
+    def make_room(self, connection, size):
+        """Drops the oldest waiting DROPPABLE_FRAMES (never one that is partly sent or packed,
+           nor history ranges, which take no memory) until size more bytes fit."""
+        outbound = connection.outbound
+        i = 1 if connection.head_committed else 0
+        while i < len(outbound) and connection.outbound_bytes + size > self.max_outbound_bytes:
+            if isinstance(outbound[i], FileRange) or outbound[i][0] not in DROPPABLE_FRAMES:
+                i += 1
+                continue
+            dropped = outbound[i]
+            del outbound[i]
+            connection.outbound_bytes -= len(dropped)
+            connection.dropped += 1
+
+    def flush(self, connection):
+        """Writes waiting frames until the socket stops taking them, then asks the
+           selector for EVENT_WRITE only if something is left."""
+        outbound = connection.outbound
+        while outbound:
+            head = outbound[0]
+            if connection.packer is not None and not connection.head_committed and isinstance(head, memoryview):
+                self.pack(connection)
+                head = outbound[0]
+            try:
+                if isinstance(head, FileRange):
+                    sent = head.send_to(connection.socket)
+                elif connection.packer is not None:
+                    sent = connection.socket.send(head)
+                elif HAVE_SENDMSG: #a batch of frames up to the next file range
+                    batch = takewhile(lambda frame: isinstance(frame, memoryview), islice(outbound, SEND_BATCH))
+                    sent = connection.socket.sendmsg(list(batch))
+                else:
+                    sent = connection.socket.send(head)
+            except BlockingIOError:
+                break
+            except (ConnectionResetError, BrokenPipeError, OSError):
+                self.metrics.send_errors += 1
+                self.failed.append(connection)
+                return
+            connection.bytes_out += sent
+            self.metrics.bytes_out += sent
+            if isinstance(head, FileRange):
+                connection.head_committed = head.length > 0
+                if connection.head_committed:
+                    break #the socket buffer is full
+                outbound.popleft()
+                continue
+            connection.outbound_bytes -= sent
+            while sent:
+                head = outbound[0]
+                if sent >= len(head):
+                    sent -= len(head)
+                    outbound.popleft()
+                    connection.head_committed = False
+                else:
+                    outbound[0] = head[sent:]
+                    connection.head_committed = True
+                    sent = 0
+            if connection.head_committed:
+                break #the socket buffer is full
+
+        want_write = bool(outbound)
+        if want_write != connection.want_write:
+            connection.want_write = want_write
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE if want_write else selectors.EVENT_READ
+            handler = self.selector.get_key(connection.socket).data
+            self.selector.modify(connection.socket, events, handler)
+
+    def disconnect_failed(self):
+        """Disconnects the clients whose sockets failed while sending. This is done
+           after the event that found them, not inside the broadcast loop, so a
+           wave of dead sockets does not recurse through disconnect and broadcast."""
+        while self.failed:
+            self.disconnect(self.failed.pop())
+
+    def close_connection(self, connection):
+        """Unregisters and closes a connection's socket; returns False if it was already closed."""
+        if connection.closed:
+            return False
+        connection.closed = True
+        self.clients.leave(connection.socket)
+        self.rooms.detach(connection)
+        self.selector.unregister(connection.socket)
+        connection.socket.close()
+        return True
+
+    def disconnect(self, connection):
+        """Closes a client's socket, logs it and notifies the other clients. A client with
+           a session is only detached from it; it leaves once the session expires."""
+        if not self.close_connection(connection):
+            return
+        if connection.session is not None and self.sessions.get(connection.session) is connection:
+            del self.sessions[connection.session]
+            self.detached[connection.session] = (connection, time.monotonic() + RESUME_SECONDS)
+            self.log(f"{connection.client_id} lost its connection.")
+            return
+        self.leave(connection)
+
+    def leave(self, connection):
+        """Logs that a client left and notifies the other clients."""
+        disconnect_message = f"{connection.client_id} has left the chat."
+        self.log(disconnect_message)
+        # Notifies other clients about disconnection
+        self.broadcast_message(protocol.encode_frame(protocol.LEAVE, connection.client_id))
+
 
 class ChatServer:
     """
     This class implements the chat server.
     It uses the socket module to create a TCP socket and act as the chat server.
-    Each chat client connects to the server and sends chat messages to it. When 
-    the server receives a message, it displays it in its own GUI and also sents 
-    the message to the other client.  
+    Each chat client connects to the server and sends chat messages to it. When
+    the server receives a message, it displays it in its own GUI and also sents
+    the message to the other client.
     It uses the tkinter module to create the GUI for the server client.
     See the project info/video for the specs.
+    The networking is done by a ChatServerCore on its own thread; this
+    window only observes its chat log. The server thread just appends log
+    lines to a bounded deque (a thread-safe operation); the Tk main loop
+    drains it every LOG_REFRESH_MS with one insert, so no Tk call is made
+    off the main thread, and the widget keeps only the last
+    LOG_HISTORY_LINES lines.
     """
-    # To implement 
-    def __init__(self, window: Tk):
+    # To implement
+    def __init__(self, window: Tk, core=None):
         """It initialzes the server GUI recreating client chat history between clients.
-           It also starts the server socket to listen for connections"""
-        
+           It also starts the server core to listen for connections"""
+
         self.window = window
         self.window.title("Chat Server")
 
         #creates label for chat history section
         Label(self.window, text = "Chat History:").grid(row=0,column=0)
-        
+
         #creates frame and text widget for chat history display
         self.chat_frame = Frame(self.window)
         self.chat_history = Text(self.chat_frame, wrap="word", height=20, width=50, state="disabled")
@@ -40,87 +830,128 @@ class ChatServer:
 
         self.chat_frame.grid(row=1, column=0, columnspan=2, padx=5, pady=5)
 
-        #create a scoket
-        self.serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        #binds socket to address
-        self.serverSocket.bind(('127.0.0.1',12345)) 
-        #enables server to accept connection
-        self.serverSocket.listen() 
+        #lines logged by the server thread and not drawn yet; older ones fall off if the GUI lags
+        self.pending_lines = deque(maxlen=LOG_HISTORY_LINES)
 
-        
-        self.clients_list = {} #list of total clients chatting
-        self.client_counter = 0  #keeps track of number of unique clients variable
+        #creates the server core and shows its chat log here
+        self.core = core if core is not None else ChatServerCore()
+        self.core.add_observer(self.pending_lines.append)
+        self.window.after(LOG_REFRESH_MS, self.show_pending_messages)
 
-        #starts thread to accept connections
-        threading.Thread(target=self.accept_client_connection, daemon=True).start() 
+        #starts thread to run the server
+        threading.Thread(target=self.core.serve_forever, name="ChatServerCore", daemon=True).start()
 
-    def accept_client_connection(self):
-        """ It creates the connection between a client and server to start sending and receiving messages.
-            It assigns each client a unique id and starts thread to handle their messages."""
-        while True:
-            client_socket, addr = self.serverSocket.accept() #accepts connection
-     
-            self.client_counter += 1 #adds a new client to the number of clients
-            client_id = f"Client {self.client_counter}" #assigns number to client for id purposes
-            
-            client_socket.send(client_id.encode()) # Send client their unique ID 
+    def show_pending_messages(self):
+        """Adds every line logged since the last frame to the chat history display
+           in one insert and trims the display to its last LOG_HISTORY_LINES lines"""
+        lines = []
+        try:
+            while True:
+                lines.append(self.pending_lines.popleft())
+        except IndexError:
+            pass
+        if lines:
+            self.chat_history.config(state = "normal")
+            self.chat_history.insert(END, "\n".join(lines[-LOG_HISTORY_LINES:]) + "\n")
+            line_count = int(self.chat_history.index("end-1c").split(".")[0]) - 1
+            if line_count > LOG_HISTORY_LINES:
+                self.chat_history.delete("1.0", f"{line_count - LOG_HISTORY_LINES + 1}.0")
+            self.chat_history.config(state = "disabled")
+            self.chat_history.see(END)
+        self.window.after(LOG_REFRESH_MS, self.show_pending_messages)
 
-            self.clients_list[client_socket] = client_id #add client to list of active connections
 
-            threading.Thread(target=self.receive_message, args=(client_socket,), daemon=True).start() #start new thread to handle messages from this client
+def create_server_socket(host=HOST, port=PORT, backlog=BACKLOG, reuse_port=False):
+    """Returns a listening TCP socket. With reuse_port, several processes can each bind
+       their own socket to the same port and the kernel spreads connections over them."""
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server_socket.bind((host, port))
+    server_socket.listen(backlog)
+    return server_socket
 
 
-    def receive_message(self, client_socket):
-         """It handles messages received from client and broadcasts message to all other clients.
-            It also deals with client disconnections"""
-         client_id = self.clients_list[client_socket]
-         while True:
-            try:
-                #receive and decode message
-                client_message = client_socket.recv(1024).decode()
-                if client_message:
-                    #format message and dispaly it in the chat history
-                    full_message = f"{client_id}: {client_message}"
-                    self.chat_history.config(state = "normal")
-                    self.chat_history.insert(END, f"{full_message}\n" )
-                    self.chat_history.config(state = "disabled")
-                    self.chat_history.see(END)
-
-                    self.broadcast_message(full_message, client_socket) #broadcasts message to the other clients
-            
-            #Handles any client disconnections
-            except (ConnectionResetError, BrokenPipeError): 
-                disconnected_client = self.clients_list.pop(client_socket, "Unknown")
-                disconnect_message = f"{disconnected_client} has left the chat."
-            
-                # Display disconnection message on server
-                self.chat_history.config(state="normal")
-                self.chat_history.insert(END, f"{disconnect_message}\n")
-                self.chat_history.config(state="disabled")
-                self.chat_history.see(END)
-
-                # Notifies other clients about disconnection
-                self.broadcast_message(disconnect_message, client_socket)
-                break
+def create_unix_server_socket(path, backlog=BACKLOG):
+    """Returns a Unix domain socket listening at path, replacing a socket file left there
+       by an earlier run."""
+    if os.path.exists(path):
+        os.unlink(path)
+    server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server_socket.bind(path)
+    server_socket.listen(backlog)
+    return server_socket
 
-    def broadcast_message(self, message, sender_socket=None):
-        """ server broadcasts message to the other clients excluding the sender """
-        for client_socket in self.clients_list:
-            if client_socket != sender_socket:  #makes sure the sender does not receive the message again
-                try:
-                    client_socket.send(message.encode())
-                except (ConnectionResetError, BrokenPipeError):
-                    # Handles disconnection during broadcasting
-                    disconnected_client = self.clients_list.pop(client_socket, "Unknown")
-                    disconnect_message = f"{disconnected_client} has left the chat."
-                    self.broadcast_message(disconnect_message)
-                    self.remove_client(client_socket)
-
-def main(): #Note that the main function is outside the ChatServer class
+
+def raise_open_file_limit():
+    """Lets the process hold as many sockets as the hard limit allows (POSIX only)."""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def create_core(workers=SERVER_WORKERS, unix_path=None, ring_name=None, admin_port=ADMIN_PORT):
+    """Returns the ChatServerCore for one server process, or the hub of workers server processes.
+       The sharded server has no ring: its broadcasts are sent by the workers, not by the hub.
+       With admin_port, the core's admin socket listens on it (see admin.py); worker N of the
+       sharded server has its own on admin_port + N."""
+    if workers > 1:
+        import shards #imported here because shards builds on this module
+        core = shards.start_shards(workers, unix_path=unix_path, admin_port=admin_port)
+    else:
+        core = ChatServerCore(unix_path=unix_path, ring_name=ring_name)
+    start_admin(core, admin_port)
+    return core
+
+def start_admin(core, port):
+    """Starts the admin socket of core on port, if port is not None. The server runs without
+       it, and logs why, if the port cannot be bound."""
+    if port is None:
+        return None
+    try:
+        core.admin = AdminServer(core, port=port).start()
+    except OSError as e:
+        core.log(f"Admin socket error on port {port}: {e}")
+    return core.admin
+
+def main(workers=SERVER_WORKERS, unix_path=None, ring_name=None, ready=None, admin_port=ADMIN_PORT): #Note that the main function is outside the ChatServer class
+    """ready, e.g. a multiprocessing.Event, is set once the server is listening."""
+    raise_open_file_limit()
     window = Tk()
-    ChatServer(window)
+    ChatServer(window, create_core(workers, unix_path, ring_name, admin_port))
+    if ready is not None:
+        ready.set()
     window.mainloop()
     #May add more or modify, if needed
 
+def main_headless(workers=SERVER_WORKERS, unix_path=None, ring_name=None, ready=None, admin_port=ADMIN_PORT):
+    """Runs the server without a GUI, printing the chat log."""
+    raise_open_file_limit()
+    core = create_core(workers, unix_path, ring_name, admin_port)
+    core.add_observer(print)
+    if ready is not None:
+        ready.set()
+    try:
+        core.serve_forever()
+    except KeyboardInterrupt:
+        core.close()
+
 if __name__ == '__main__': # May be used ONLY for debugging
-    main()
+    workers = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else SERVER_WORKERS
+    unix_path = sys.argv[sys.argv.index("--unix") + 1] if "--unix" in sys.argv else None
+    ring_name = sys.argv[sys.argv.index("--ring") + 1] if "--ring" in sys.argv else None
+    admin_port = int(sys.argv[sys.argv.index("--admin") + 1]) if "--admin" in sys.argv else ADMIN_PORT
+    if "--no-admin" in sys.argv:
+        admin_port = None
+    if "--headless" in sys.argv:
+        main_headless(workers, unix_path, ring_name, admin_port=admin_port)
+    else:
+        main(workers, unix_path, ring_name, admin_port=admin_port)
@@ -0,0 +1,225 @@
+#Content of shards.py; multi-process chat server built on server.py
+
+"""The sharded server runs SERVER_WORKERS worker processes that all accept
+   clients on the same port, so connections and sends are spread over several
+   cores instead of one GIL. The workers are linked to a hub in the process
+   that started them, which puts every broadcast in one global order:
+
+       client -> worker --PUBLISH--> hub (logs it, gives it its sequence number)
+       hub --DELIVER--> every worker -> that worker's clients
+
+   Room messages travel the same way but are not logged; each worker sends
+   them to its own members of the room. A direct message goes from the
+   sender's worker through the hub to the recipient's worker only, which the
+   hub knows from the recipient's client number; if the recipient is not
+   connected there, that worker sends the ERROR back the same way.
+
+   Each worker receives the deliveries in the hub's order over its own link,
+   so every client sees the same order, whichever worker it is on. The hub
+   owns the message log; workers open it readonly to answer HISTORY requests
+   from the files. Client numbers are strided over the workers (worker i of
+   K hands out i+1, i+1+K, ...), so they are unique without any coordination.
+   The workers do not offer "resume": sessions live in the worker that made
+   them, and a reconnecting client usually lands on another worker. Such a
+   client reconnects as a new client and catches up from the message log.
+   Each worker has its own admin socket (admin.py), on the port after the
+   hub's plus its index, since its clients and counters are its own."""
+
+import multiprocessing
+import selectors
+import socket
+import struct
+import time
+
+import protocol
+from message_log import MessageLog
+from server import (HOST, PORT, HISTORY_DIR, ChatServerCore, ClientConnection, create_server_socket,
+                    create_unix_server_socket, raise_open_file_limit, start_admin)
+
+REUSE_PORT = hasattr(socket, "SO_REUSEPORT") #else the workers share one inherited listening socket
+WORKER_START_SECONDS = 10 #how long start_shards waits for the workers to be listening
+WORKER_POLL_SECONDS = 0.1 #how often start_shards checks that no worker died while it waits
+
+#frame types used only on the links between the hub and the workers
+BUS_PUBLISH = 101  #worker -> hub: sender's client number (8 bytes) and a frame to broadcast
+BUS_DELIVER = 102  #hub -> worker: sender's client number (8 bytes) and the RECORD frame to send
+BUS_LOG = 103      #worker -> hub: a chat log line for the server window
+BUS_ROOM = 104     #worker -> hub -> every worker: sender's client number (8 bytes) and a ROOM_CHAT frame
+BUS_DIRECT = 105   #worker -> hub -> recipient's worker: recipient's and sender's client numbers (8 bytes each) and a
+                   #DIRECT frame, or an ERROR frame and sender 0 when the recipient was not connected
+
+SENDER = struct.Struct("!Q")
+ADDRESSES = struct.Struct("!QQ") #recipient's and sender's client numbers of BUS_DIRECT
+
+
+class ShardHub(ChatServerCore):
+    """
+    The sequencer in the middle of the workers. It does not listen for
+    clients; its connections are the links to the workers, which are never
+    subject to the slow client policy, so no worker misses a message.
+    It has the same observers as a ChatServerCore, so the ChatServer window
+    shows the chat log of every worker.
+    """
+
+    def __init__(self, links, history_dir=HISTORY_DIR):
+        super().__init__(host=None, history_dir=history_dir)
+        self.workers = [] #links in worker index order
+        for i, link in enumerate(links):
+            link.setblocking(False)
+            connection = ClientConnection(link, f"Server worker {i + 1}")
+            connection.lossless = True
+            self.clients.join(connection)
+            self.workers.append(connection)
+            self.selector.register(link, selectors.EVENT_READ, self.handle_client_event)
+
+    def handle_frame(self, connection, frame_type, payload):
+        if frame_type == BUS_PUBLISH:
+            sender_number, = SENDER.unpack_from(payload)
+            self.broadcast_message(payload[SENDER.size:], sender_number)
+        elif frame_type == BUS_ROOM:
+            message = memoryview(protocol.encode_frame(BUS_ROOM, payload))
+            for worker in self.workers:
+                self.send(worker, message)
+        elif frame_type == BUS_DIRECT:
+            number, = SENDER.unpack_from(payload)
+            if number:
+                self.send(self.workers[(number - 1) % len(self.workers)], protocol.encode_frame(BUS_DIRECT, payload))
+        elif frame_type == BUS_LOG:
+            self.log(payload.decode("utf-8", "replace"))
+
+    def fan_out(self, frame, sender_number=0):
+        """Hands a logged frame to every worker, which sends it on to its clients but the sender."""
+        delivery = memoryview(protocol.encode_frame(BUS_DELIVER, SENDER.pack(sender_number) + frame))
+        for worker in self.clients.snapshot():
+            self.send(worker, delivery)
+
+    def disconnect(self, connection):
+        if self.close_connection(connection):
+            self.log(f"{connection.client_id} stopped.")
+
+
+class ShardWorker(ChatServerCore):
+    """
+    One worker process of the sharded server. Its clients are handled as in
+    ChatServerCore, except that broadcasts and log lines go to the hub, and
+    messages are sent to the clients when the hub delivers them back.
+    Sessions cannot be resumed on another worker, so "resume" is not offered.
+    """
+
+    def __init__(self, index, workers, link, server_socket=None, host=HOST, port=PORT, history_dir=HISTORY_DIR,
+                 unix_socket=None):
+        super().__init__(host=host, port=port, server_socket=server_socket, reuse_port=server_socket is None,
+                         first_id=index + 1, id_step=workers, history_dir=None, unix_socket=unix_socket)
+        self.index = index
+        self.worker_count = workers
+        self.caps = self.caps - {protocol.CAP_RESUME}
+        #the hub opened the log before starting the workers
+        self.message_log = MessageLog(history_dir, readonly=True) if history_dir is not None else None
+        link.setblocking(False)
+        self.hub = ClientConnection(link, "hub")
+        self.hub.lossless = True
+        self.selector.register(link, selectors.EVENT_READ, self.handle_hub_event)
+
+    def handle_hub_event(self, link, mask):
+        if mask & selectors.EVENT_WRITE:
+            self.flush(self.hub)
+        if mask & selectors.EVENT_READ and not self.hub.closed:
+            self.receive_message(self.hub)
+
+    def handle_frame(self, connection, frame_type, payload):
+        if connection is not self.hub:
+            super().handle_frame(connection, frame_type, payload)
+        elif frame_type == BUS_DELIVER:
+            sender_number, = SENDER.unpack_from(payload)
+            record = payload[SENDER.size:]
+            if self.message_log is not None and record[0] == protocol.RECORD:
+                seq, = protocol.RECORD_SEQ.unpack_from(record, protocol.HEADER.size)
+                self.message_log.advance(seq + 1)
+            self.fan_out(record, sender_number)
+        elif frame_type == BUS_ROOM:
+            sender_number, = SENDER.unpack_from(payload)
+            frame = payload[SENDER.size:]
+            try:
+                room, _ = protocol.decode_addressed(frame[protocol.HEADER.size:])
+            except protocol.ProtocolError:
+                return
+            self.fan_out_room(room, frame, sender_number)
+        elif frame_type == BUS_DIRECT:
+            number, sender_number = ADDRESSES.unpack_from(payload)
+            super().send_direct(number, payload[ADDRESSES.size:], sender_number)
+
+    def broadcast_message(self, frame, sender_number=0):
+        """Sends the frame to the hub, which logs it and delivers it to every worker."""
+        self.send(self.hub, protocol.encode_frame(BUS_PUBLISH, SENDER.pack(sender_number) + frame))
+
+    def send_to_room(self, room, frame, sender_number=0):
+        """Sends the room message to the hub, which hands it to every worker."""
+        self.send(self.hub, protocol.encode_frame(BUS_ROOM, SENDER.pack(sender_number) + frame))
+
+    def send_direct(self, number, frame, sender_number=0):
+        """Sends a direct message to a client of this worker, or through the hub to its worker."""
+        if (number - 1) % self.worker_count == self.index:
+            super().send_direct(number, frame, sender_number)
+        else:
+            self.send(self.hub, protocol.encode_frame(BUS_DIRECT, ADDRESSES.pack(number, sender_number) + frame))
+
+    def log(self, line):
+        self.send(self.hub, protocol.encode_frame(BUS_LOG, line))
+
+    def disconnect(self, connection):
+        if connection is self.hub:
+            self.close_connection(connection)
+            self.running = False #without the hub this worker cannot deliver anything
+        else:
+            super().disconnect(connection)
+
+
+def run_worker(index, workers, link, server_socket, host, port, history_dir, unix_socket=None, listening=None,
+               admin_port=None):
+    """Entry point of a worker process; releases the listening semaphore once it accepts clients."""
+    raise_open_file_limit()
+    worker = ShardWorker(index, workers, link, server_socket, host, port, history_dir, unix_socket)
+    start_admin(worker, admin_port + index + 1 if admin_port is not None else None)
+    if listening is not None:
+        listening.release()
+    try:
+        worker.serve_forever()
+    except KeyboardInterrupt:
+        worker.close()
+
+
+def start_shards(workers, host=HOST, port=PORT, history_dir=HISTORY_DIR, unix_path=None, admin_port=None):
+    """Starts the worker processes and returns the ShardHub linking them once every worker
+       is listening; the caller runs its serve_forever. The workers are daemons, so they
+       end with this process. If a worker dies or is not listening after
+       WORKER_START_SECONDS, the others are stopped and RuntimeError is raised.
+       With unix_path the workers also share one inherited Unix domain socket. With
+       admin_port, worker N serves its admin socket on admin_port + N; the caller starts
+       the hub's."""
+    links = [socket.socketpair() for _ in range(workers)]
+    hub = ShardHub([hub_end for hub_end, _ in links], history_dir)
+    server_socket = None if REUSE_PORT else create_server_socket(host, port)
+    unix_socket = create_unix_server_socket(unix_path) if unix_path is not None else None
+    listening = multiprocessing.Semaphore(0)
+    processes = []
+    for index, (_, worker_end) in enumerate(links):
+        process = multiprocessing.Process(target=run_worker, name=f"ChatWorker{index + 1}", daemon=True,
+                                          args=(index, workers, worker_end, server_socket, host, port, history_dir,
+                                                unix_socket, listening, admin_port))
+        process.start()
+        processes.append(process)
+        worker_end.close()
+    for listening_socket in (server_socket, unix_socket):
+        if listening_socket is not None:
+            listening_socket.close() #each worker has its own copy
+    deadline = time.monotonic() + WORKER_START_SECONDS
+    started = 0
+    while started < workers:
+        if listening.acquire(timeout=WORKER_POLL_SECONDS):
+            started += 1
+        elif time.monotonic() >= deadline or not all(process.is_alive() for process in processes):
+            for process in processes:
+                process.terminate()
+            hub.close()
+            raise RuntimeError(f"only {started} of {workers} server workers started listening")
+    return hub
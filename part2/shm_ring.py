@@ -0,0 +1,151 @@
+#Content of shm_ring.py; shared-memory broadcast ring used by server.py and client.py
+
+"""A ring buffer in shared memory that carries the server's broadcasts to
+   clients on the same machine. The server is the only writer: each broadcast
+   is copied into the ring once, however many clients read it, instead of
+   being sent to every client through the loopback TCP stack. Each client
+   reads the ring at its own position.
+
+   Layout: the write position (bytes ever written) and the ring size, then
+   the data. Every entry is a 16 byte header (frame length, kind, sender's
+   client number) and the frame, padded to 16 bytes. An entry never wraps;
+   if it does not fit before the end, a PADDING entry fills the rest. The
+   write position is stored after the entry is complete, so readers never
+   see half an entry.
+
+   The writer never waits for readers. While it writes an entry, it may be
+   up to two of the largest entries past its published position: the
+   PADDING before a wrap (shorter than the entry that did not fit) and the
+   entry itself. A reader that falls more than the ring size less that
+   margin (half the ring) behind may have had entries overwritten; read()
+   reports that as an overrun and the reader catches up some other way
+   (the chat client asks the server's message log). Readers poll, backing
+   off from POLL_MIN to POLL_MAX while the ring is idle; a shared Condition
+   would make the server wait for every sleeping reader to wake up."""
+
+import os
+import struct
+from multiprocessing import shared_memory
+
+RING_BYTES = 4 * 1024 * 1024 #data bytes in the ring; a multiple of ALIGN
+POLL_MIN = 0.0005 #seconds between polls right after data arrived
+POLL_MAX = 0.02 #seconds between polls when the ring has been idle
+
+HEADER = struct.Struct("=QQ") #write position, data size
+DATA_OFFSET = 64 #the header has the first cache line to itself
+ENTRY = struct.Struct("=IIQ") #frame length, kind, sender's client number
+ALIGN = 16
+
+#entry kinds
+RECORD = 0   #a frame
+PADDING = 1  #the rest of the ring up to its end is unused
+MISSING = 2  #a frame too large for the ring was left out
+
+
+def aligned(size):
+    return (size + ALIGN - 1) & ~(ALIGN - 1)
+
+
+def attach(name):
+    """Opens an existing ring's shared memory without taking over its cleanup;
+       the process that created it unlinks it."""
+    try:
+        return shared_memory.SharedMemory(name, track=False) #Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name)
+        if os.name == "posix":
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class RingWriter:
+    """Creates the ring and appends entries to it. Only one thread of one process may write."""
+
+    def __init__(self, name, size=RING_BYTES):
+        self.size = aligned(size)
+        self.max_record = self.size // 4 #larger frames become MISSING entries
+        self.shm = shared_memory.SharedMemory(name, create=True, size=DATA_OFFSET + self.size)
+        self.buffer = self.shm.buf
+        self.position = 0
+        HEADER.pack_into(self.buffer, 0, self.position, self.size)
+
+    def publish(self, frame, sender_number=0):
+        """Copies a frame into the ring for every reader."""
+        length = len(frame)
+        need = aligned(ENTRY.size + length)
+        kind = RECORD
+        if need > self.max_record:
+            kind, length, need = MISSING, 0, ENTRY.size
+        offset = self.position % self.size
+        if offset + need > self.size: #does not fit before the end; start over at the beginning
+            ENTRY.pack_into(self.buffer, DATA_OFFSET + offset, 0, PADDING, 0)
+            self.position += self.size - offset
+            offset = 0
+        start = DATA_OFFSET + offset
+        ENTRY.pack_into(self.buffer, start, length, kind, sender_number)
+        if kind == RECORD:
+            self.buffer[start + ENTRY.size:start + ENTRY.size + length] = frame
+        self.position += need
+        HEADER.pack_into(self.buffer, 0, self.position, self.size) #publishes the entry (one aligned 8 byte store)
+
+    def close(self):
+        self.buffer.release()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class RingReader:
+    """Reads the entries of a ring written by another process, from a given write position on."""
+
+    def __init__(self, name, position):
+        self.shm = attach(name)
+        self.buffer = self.shm.buf
+        self.size = HEADER.unpack_from(self.buffer, 0)[1]
+        self.max_record = self.size // 4
+        self.max_behind = self.size - 2 * self.max_record #farther behind, the writer may be overwriting unread entries
+        self.position = position
+
+    def write_position(self):
+        return HEADER.unpack_from(self.buffer, 0)[0]
+
+    def read(self):
+        """Returns (records, missed): the (sender_number, frame) entries written since the
+           last read, and whether any were lost, because this reader was overrun or a frame
+           was too large for the ring. After an overrun the reader continues at the writer's
+           position."""
+        start = self.position
+        end = self.write_position()
+        if end == start:
+            return [], False
+        if end - start > self.max_behind:
+            return self.overrun()
+        records = []
+        missed = False
+        position = start
+        while position < end:
+            offset = position % self.size
+            length, kind, sender_number = ENTRY.unpack_from(self.buffer, DATA_OFFSET + offset)
+            if kind == PADDING:
+                position += self.size - offset
+            elif kind == MISSING:
+                missed = True
+                position += ENTRY.size
+            elif kind == RECORD and offset + ENTRY.size + length <= self.size:
+                data_start = DATA_OFFSET + offset + ENTRY.size
+                records.append((sender_number, bytes(self.buffer[data_start:data_start + length])))
+                position += aligned(ENTRY.size + length)
+            else:
+                return self.overrun() #overwritten while being read
+        if self.write_position() - start > self.max_behind:
+            return self.overrun() #the writer may have reached what was just copied
+        self.position = position
+        return records, missed
+
+    def overrun(self):
+        self.position = self.write_position()
+        return [], True
+
+    def close(self):
+        self.buffer.release()
+        self.shm.close()